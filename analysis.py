@@ -0,0 +1,157 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+# File layout: <4s magic> <u32 format> <u64 slots>, then 16-byte slots of
+# <u64 key ^ data> <u64 data>. Bump the format when the engine's Zobrist
+# keys or the data packing change, so old files are wiped rather than read.
+CACHE_HEADER = struct.Struct("<4sIQ")
+CACHE_MAGIC = b"CHAN"
+CACHE_FORMAT = 1
+SLOT = struct.Struct("<QQ")
+# Slots per bucket; a key can only live in its bucket, 64 bytes apart
+BUCKET_SLOTS = 4
+BUCKET = struct.Struct("<" + "Q" * 2 * BUCKET_SLOTS)
+SCORE_OFFSET = 1 << 23
+STAMP_MASK = 0xFFFF
+
+
+def _stamp():
+    """Coarse wall-clock time (4 s steps, wrapping after 3 days) for LRU ages"""
+    return int(time.time()) >> 2 & STAMP_MASK
+
+
+def _pack(move_code, score, depth, stamp):
+    return (
+        move_code | (score + SCORE_OFFSET) << 16 | depth << 40 | stamp << 48
+    ) & 0xFFFFFFFFFFFFFFFF
+
+
+class AnalysisCache:
+    """Search results by position, shared by every process forked after it
+
+    A fixed table of ``budget`` bytes, mapped from ``path`` so it survives
+    restarts, or anonymous memory otherwise. Keys land in a bucket of four
+    slots; a full bucket evicts its least recently used entry and a key
+    already present is only replaced by a deeper search. Each slot stores
+    its key XOR its data, so a slot torn by two processes writing at once
+    reads as a miss instead of a wrong move.
+    """
+
+    def __init__(self, budget, path=None):
+        buckets = max(budget // (SLOT.size * BUCKET_SLOTS), 1)
+        self.slots = buckets * BUCKET_SLOTS
+        self.buckets = buckets
+        self.path = path
+        size = CACHE_HEADER.size + self.slots * SLOT.size
+        if path is None:
+            self._mm = mmap.mmap(-1, size)
+            CACHE_HEADER.pack_into(self._mm, 0, CACHE_MAGIC, CACHE_FORMAT, self.slots)
+        else:
+            self._mm = self._open(path, size)
+
+    def _open(self, path, size):
+        """Map ``path``, wiping it unless it holds a table of this shape"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Workers starting together must not wipe each other's table
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.pread(fd, CACHE_HEADER.size, 0)
+            expected = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, self.slots)
+            if header != expected or os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, expected, 0)
+            mm = mmap.mmap(fd, size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+        return mm
+
+    def __len__(self):
+        return self.slots
+
+    def _bucket(self, key):
+        return CACHE_HEADER.size + (key % self.buckets) * BUCKET.size
+
+    def get(self, key):
+        """``(move_code, score, depth)`` stored for ``key``, or None"""
+        base = self._bucket(key)
+        values = BUCKET.unpack_from(self._mm, base)
+        for i in range(BUCKET_SLOTS):
+            check, data = values[2 * i], values[2 * i + 1]
+            if data and check ^ data == key:
+                stamp = _stamp()
+                if data >> 48 != stamp:
+                    data = data & (1 << 48) - 1 | stamp << 48
+                    SLOT.pack_into(self._mm, base + i * SLOT.size, key ^ data, data)
+                return (
+                    data & 0xFFFF,
+                    (data >> 16 & 0xFFFFFF) - SCORE_OFFSET,
+                    data >> 40 & 0xFF,
+                )
+        return None
+
+    def put(self, key, move_code, score, depth):
+        """Store a search result unless ``key`` already has a deeper one"""
+        base = self._bucket(key)
+        values = BUCKET.unpack_from(self._mm, base)
+        now = _stamp()
+        victim, oldest = 0, -1
+        for i in range(BUCKET_SLOTS):
+            check, data = values[2 * i], values[2 * i + 1]
+            if not data:
+                victim, oldest = i, STAMP_MASK + 1
+                continue
+            if check ^ data == key:
+                if data >> 40 & 0xFF > depth:
+                    return
+                victim = i
+                break
+            age = (now - (data >> 48)) & STAMP_MASK
+            if age > oldest:
+                victim, oldest = i, age
+        data = _pack(move_code, score, min(depth, 0xFF), now)
+        SLOT.pack_into(self._mm, base + victim * SLOT.size, key ^ data, data)
+
+    def close(self):
+        if self.path is not None:
+            self._mm.flush()
+        self._mm.close()
+
+
+def _bench(budget, lookups, seed=1):
+    """Microseconds per get and put, and the hit rate of a skewed workload"""
+    import random
+
+    rng = random.Random(seed)
+    cache = AnalysisCache(budget)
+    # Few popular positions (openings) and a long tail
+    popular = [rng.getrandbits(64) for _ in range(1000)]
+    keys = [
+        rng.choice(popular) if rng.random() < 0.6 else rng.getrandbits(64)
+        for _ in range(lookups)
+    ]
+    hits = 0
+    started = time.perf_counter()
+    for key in keys:
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.put(key, 0x1234, 25, 4)
+    elapsed = time.perf_counter() - started
+    cache.close()
+    return elapsed / lookups * 1e6, hits / lookups
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the analysis cache")
+    parser.add_argument("--mb", type=int, default=16)
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+    micros, hit_rate = _bench(args.mb << 20, args.lookups)
+    print(f"{micros:.2f} us per lookup, hit rate {hit_rate:.1%}")
@@ -0,0 +1,413 @@
+import fcntl
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import chess
+import chess.pgn
+
+from clocks import parse_time_control
+from models import decode_move
+
+# Segment files hold records of <u32 body length> <u32 CRC32 of body> and
+# a body of <f64 start> <f64 end> <u8 winner> <u8 bot level> <u16 plies>,
+# then game id, white, black, time control, result, ECO and opening name
+# as <u8 length> <UTF-8>, then the moves as little-endian u16 codes
+RECORD_HEADER = struct.Struct("<II")
+GAME_FIELDS = struct.Struct("<ddBBH")
+# Index files list <16s game id> <u32 offset> for each segment's records;
+# a record counts as archived once its index entry is written
+INDEX_ENTRY = struct.Struct("<16sI")
+SEGMENT_NAME = "games-{:08d}.bin"
+INDEX_NAME = "games-{:08d}.idx"
+DRAW = 2
+DEFAULT_SEGMENT_BYTES = 64 << 20
+# Largest record body: the fixed fields, seven strings and 65535 moves
+MAX_BODY_BYTES = GAME_FIELDS.size + 7 * 256 + 2 * 0xFFFF
+
+# PGN Termination tag for each way a game can end
+TERMINATIONS = {
+    "timeout": "time forfeit",
+    "forfeit": "abandoned",
+    "tablebase_win": "adjudication",
+    "tablebase_draw": "adjudication",
+}
+
+ArchivedGame = namedtuple(
+    "ArchivedGame",
+    [
+        "location",
+        "game_id",
+        "white",
+        "black",
+        "result",
+        "winner",
+        "time_control",
+        "eco",
+        "opening",
+        "bot",
+        "start_time",
+        "end_time",
+        "moves",
+    ],
+)
+
+
+def _pack_string(value):
+    encoded = (value or "").encode("utf-8")[:255]
+    return bytes([len(encoded)]) + encoded
+
+
+def _encode(game):
+    """Archive record body for a finished ``game``"""
+    eco, opening = game.opening or (None, None)
+    moves = game.moves
+    if sys.byteorder == "big":
+        moves = array("H", moves)
+        moves.byteswap()
+    return b"".join(
+        [
+            GAME_FIELDS.pack(
+                game.start_time,
+                time.time(),
+                DRAW if game.winner is None else game.winner,
+                game.bot or 0,
+                len(moves),
+            ),
+            _pack_string(game.game_id),
+            _pack_string(game.usernames[0]),
+            _pack_string(game.usernames[1]),
+            _pack_string(game.time_control),
+            _pack_string(game.result),
+            _pack_string(eco),
+            _pack_string(opening),
+            moves.tobytes(),
+        ]
+    )
+
+
+def _decode(location, body):
+    start_time, end_time, winner, bot, plies = GAME_FIELDS.unpack_from(body)
+    offset = GAME_FIELDS.size
+    strings = []
+    for _ in range(7):
+        length = body[offset]
+        strings.append(
+            bytes(body[offset + 1 : offset + 1 + length]).decode("utf-8", "ignore")
+        )
+        offset += 1 + length
+    game_id, white, black, time_control, result, eco, opening = strings
+    moves = array("H")
+    moves.frombytes(body[offset : offset + 2 * plies])
+    if sys.byteorder == "big":
+        moves.byteswap()
+    return ArchivedGame(
+        location,
+        game_id,
+        white,
+        black,
+        result,
+        None if winner == DRAW else winner,
+        time_control,
+        eco or None,
+        opening or None,
+        bot or None,
+        start_time,
+        end_time,
+        moves,
+    )
+
+
+def location(seq, offset):
+    """One sortable number for a record: its segment, then its offset"""
+    return seq << 32 | offset
+
+
+def to_pgn(archived):
+    """PGN text of an archived game, with headers"""
+    game = chess.pgn.Game()
+    started = datetime.fromtimestamp(archived.start_time, timezone.utc)
+    headers = game.headers
+    headers["Event"] = "Local Chess game"
+    headers["Site"] = "Local Chess"
+    headers["Date"] = started.strftime("%Y.%m.%d")
+    headers["Round"] = "-"
+    headers["White"] = archived.white or "?"
+    headers["Black"] = archived.black or "?"
+    if archived.winner is None:
+        headers["Result"] = "1/2-1/2"
+    else:
+        headers["Result"] = "1-0" if archived.winner == 0 else "0-1"
+    headers["GameId"] = archived.game_id
+    headers["UTCDate"] = headers["Date"]
+    headers["UTCTime"] = started.strftime("%H:%M:%S")
+    try:
+        initial, increment, delay = parse_time_control(archived.time_control)
+        headers["TimeControl"] = f"{initial}+{increment}"
+    except ValueError:
+        pass
+    if archived.eco:
+        headers["ECO"] = archived.eco
+        headers["Opening"] = archived.opening
+    headers["Termination"] = TERMINATIONS.get(archived.result, "normal")
+    game.add_line(decode_move(code) for code in archived.moves)
+    exporter = chess.pgn.StringExporter(headers=True, variations=False, comments=False)
+    return game.accept(exporter) + "\n\n"
+
+
+class GameArchive:
+    """Finished games in ``directory``, about two bytes per move
+
+    Records are appended to numbered segment files, starting a new one
+    once a segment would pass ``segment_bytes``, and each segment has an
+    index of game ids and offsets. Appends take a file lock so several
+    server processes can share one archive; each process keeps the latest
+    location of every game id in memory and reads index entries written by
+    others before answering.
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._locations = {}
+        self._count = 0
+        # Bytes of each segment's index already read into ``_locations``
+        self._indexed = {}
+        self._seq = 0
+        self._fd = None
+        self._index_fd = None
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(
+            os.path.join(directory, "lock"), os.O_RDWR | os.O_CREAT, 0o644
+        )
+        seqs = self._segments()
+        self._seq = seqs[-1] if seqs else 0
+        self._refresh()
+
+    def _path(self, name, seq):
+        return os.path.join(self.directory, name.format(seq))
+
+    def _segments(self):
+        """Sequence numbers of the segments on disk, oldest first"""
+        return sorted(
+            int(name[6:-4])
+            for name in os.listdir(self.directory)
+            if name.startswith("games-") and name.endswith(".bin")
+        )
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def _refresh(self):
+        """Read index entries appended since the last look; caller holds ``_lock``"""
+        # Only the newest segment is ever appended to
+        seq = max(self._indexed, default=0)
+        while True:
+            path = self._path(INDEX_NAME, seq)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                if not os.path.exists(self._path(SEGMENT_NAME, seq + 1)):
+                    return
+                seq += 1
+                continue
+            read = self._indexed.get(seq, 0)
+            size -= size % INDEX_ENTRY.size
+            if size > read:
+                with open(path, "rb") as f:
+                    f.seek(read)
+                    data = f.read(size - read)
+                for raw_id, offset in INDEX_ENTRY.iter_unpack(data):
+                    game_id = raw_id.rstrip(b"\0").decode("utf-8")
+                    self._locations[game_id] = location(seq, offset)
+                    self._count += 1
+                self._indexed[seq] = size
+            seq += 1
+
+    def append(self, game):
+        """Archive a finished game and return its location"""
+        body = _encode(game)
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+        raw_id = game.game_id.encode("utf-8")
+        if len(raw_id) > 16:
+            raise ValueError(f"Game id {game.game_id!r} is too long to archive")
+        with self._lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                # Another process may have started newer segments
+                while os.path.exists(self._path(SEGMENT_NAME, self._seq + 1)):
+                    self._seq += 1
+                    self._close_segment()
+                if self._fd is None:
+                    self._open_segment()
+                offset = os.fstat(self._fd).st_size
+                if offset and offset + len(record) > self.segment_bytes:
+                    self._seq += 1
+                    self._close_segment()
+                    self._open_segment()
+                    offset = 0
+                os.write(self._fd, record)
+                os.write(self._index_fd, INDEX_ENTRY.pack(raw_id, offset))
+                where = location(self._seq, offset)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            self._refresh()
+        return where
+
+    def _open_segment(self):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self._fd = os.open(self._path(SEGMENT_NAME, self._seq), flags, 0o644)
+        self._index_fd = os.open(self._path(INDEX_NAME, self._seq), flags, 0o644)
+        # A crash can leave half an index entry; drop it before appending
+        size = os.fstat(self._index_fd).st_size
+        if size % INDEX_ENTRY.size:
+            os.ftruncate(self._index_fd, size - size % INDEX_ENTRY.size)
+
+    def _close_segment(self):
+        for fd in (self._fd, self._index_fd):
+            if fd is not None:
+                os.fsync(fd)
+                os.close(fd)
+        self._fd = self._index_fd = None
+
+    def locate(self, game_id):
+        """Location of the last archived game with ``game_id``, or None"""
+        with self._lock:
+            self._refresh()
+            return self._locations.get(game_id)
+
+    def read(self, where):
+        """The ArchivedGame at location ``where``
+
+        ValueError if no record starts there, OSError if its segment is gone.
+        """
+        if where < 0:
+            raise ValueError(f"No archive record at {where}")
+        seq, offset = where >> 32, where & 0xFFFFFFFF
+        with open(self._path(SEGMENT_NAME, seq), "rb") as f:
+            f.seek(offset)
+            return self._read_record(f, where)
+
+    def _read_record(self, f, where):
+        header = f.read(RECORD_HEADER.size)
+        if len(header) != RECORD_HEADER.size:
+            raise ValueError(f"Archive record at {where} is damaged")
+        length, crc = RECORD_HEADER.unpack(header)
+        # A location that is not a record start reads as garbage; do not
+        # read a garbage length's worth of segment
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Archive record at {where} is damaged")
+        body = f.read(length)
+        if len(body) != length or zlib.crc32(body) != crc:
+            raise ValueError(f"Archive record at {where} is damaged")
+        return _decode(where, body)
+
+    def get(self, game_id):
+        """The last archived game with ``game_id``, or None"""
+        where = self.locate(game_id)
+        return None if where is None else self.read(where)
+
+    def scan(self, start=0):
+        """Yield archived games from location ``start`` on, oldest first
+
+        Reads one segment's index at a time, so memory use does not grow
+        with the size of the archive.
+        """
+        with self._lock:
+            self._refresh()
+            indexed = dict(self._indexed)
+        for seq in sorted(indexed):
+            if location(seq + 1, 0) <= start:
+                continue
+            with open(self._path(INDEX_NAME, seq), "rb") as f:
+                entries = f.read(indexed[seq])
+            with open(self._path(SEGMENT_NAME, seq), "rb") as f:
+                for raw_id, offset in INDEX_ENTRY.iter_unpack(entries):
+                    where = location(seq, offset)
+                    if where < start:
+                        continue
+                    f.seek(offset)
+                    try:
+                        yield self._read_record(f, where)
+                    except ValueError as e:
+                        game_id = raw_id.rstrip(b"\0").decode("utf-8", "replace")
+                        print(
+                            f"Skipping damaged archive record of game {game_id} "
+                            f"in {self._path(SEGMENT_NAME, seq)}: {e}"
+                        )
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+        os.close(self._lock_fd)
+
+
+def _bench(games, seed=1):
+    """Archive ``games`` random games; returns bytes per move and the seconds
+    taken to append, scan and export them all as PGN"""
+    import random
+    import shutil
+    import tempfile
+
+    from models import Game
+
+    rng = random.Random(seed)
+    templates = []
+    for i in range(32):
+        game = Game(f"T{i}", "5+3", None, "White")
+        game.usernames[1] = "Black"
+        plies = rng.randrange(20, 120)
+        while len(game.moves) < plies and not game.board.is_game_over():
+            game.push(rng.choice(list(game.board.legal_moves)))
+        game.result, game.winner = "resignation", rng.choice((0, 1))
+        templates.append(game)
+
+    directory = tempfile.mkdtemp(prefix="archive-bench-")
+    try:
+        archive = GameArchive(directory)
+        moves = 0
+        started = time.perf_counter()
+        for i in range(games):
+            game = templates[i % len(templates)]
+            game.game_id = f"G{i:07d}"
+            archive.append(game)
+            moves += len(game.moves)
+        appended = time.perf_counter() - started
+        size = sum(
+            os.path.getsize(archive._path(SEGMENT_NAME, seq))
+            for seq in archive._segments()
+        )
+        started = time.perf_counter()
+        assert sum(1 for _ in archive.scan()) == games
+        scanned = time.perf_counter() - started
+        started = time.perf_counter()
+        exported = sum(len(to_pgn(game)) for game in archive.scan())
+        pgn = time.perf_counter() - started
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+    return size / moves, appended, scanned, pgn, exported
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the game archive")
+    parser.add_argument("--games", type=int, default=20000)
+    args = parser.parse_args()
+    per_move, appended, scanned, pgn, exported = _bench(args.games)
+    print(f"{per_move:.2f} bytes per move including headers")
+    print(
+        f"{args.games} games appended in {appended:.2f}s, "
+        f"scanned in {scanned:.2f}s, exported as {exported / 1e6:.1f} MB of "
+        f"PGN in {pgn:.2f}s"
+    )
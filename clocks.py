@@ -0,0 +1,104 @@
+import re
+import time
+
+# "minutes+increment" (Fischer) or "minutes d delay" (Bronstein), e.g. "10+5", "5d3"
+TIME_CONTROL_PATTERN = re.compile(r"^(\d{1,3})(?:([+d])(\d{1,3}))?$")
+DEFAULT_TIME_CONTROL = "20+0"
+
+
+def parse_time_control(spec):
+    """Return ``(initial, increment, delay)`` in seconds for a time control string"""
+    match = TIME_CONTROL_PATTERN.match(str(spec).strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid time control: {spec!r}")
+    initial = int(match.group(1)) * 60
+    bonus = int(match.group(3) or 0)
+    if match.group(2) == "d":
+        return initial, 0, bonus
+    return initial, bonus, 0
+
+
+class GameClock:
+    """Two-sided chess clock measured with ``time.monotonic()``
+
+    Only the running side's clock ticks. Pressing the clock charges the
+    elapsed time and then credits the Fischer increment, or up to ``delay``
+    seconds of the time just used (Bronstein). A side whose time runs out
+    is recorded in ``flagged`` and the clock stops.
+    """
+
+    __slots__ = ("remaining", "increment", "delay", "running", "started_at", "flagged")
+
+    def __init__(self, initial, increment=0, delay=0):
+        self.remaining = [float(initial), float(initial)]
+        self.increment = increment
+        self.delay = delay
+        self.running = None
+        self.started_at = None
+        self.flagged = None
+
+    @classmethod
+    def from_time_control(cls, spec):
+        return cls(*parse_time_control(spec))
+
+    def start(self, side, now=None):
+        """Start ``side``'s clock unless the game was already lost on time"""
+        if self.flagged is not None:
+            return
+        self.running = side
+        self.started_at = time.monotonic() if now is None else now
+
+    def pause(self, now=None):
+        """Stop the running clock, charging the time used so far"""
+        if self.running is None:
+            return
+        now = time.monotonic() if now is None else now
+        side = self.running
+        self.remaining[side] = max(0.0, self.remaining[side] - (now - self.started_at))
+        self.running = None
+        self.started_at = None
+
+    def press(self, side, now=None):
+        """End ``side``'s turn and start the opponent's; False if ``side`` flagged"""
+        now = time.monotonic() if now is None else now
+        if self.running == side:
+            elapsed = now - self.started_at
+            left = self.remaining[side] - elapsed
+            if left <= 0:
+                self.flag(side)
+                return False
+            self.remaining[side] = left + self.increment + min(elapsed, self.delay)
+        self.start(1 - side, now)
+        return True
+
+    def flag(self, side):
+        """Record that ``side`` lost on time and stop the clock"""
+        self.remaining[side] = 0.0
+        self.flagged = side
+        self.running = None
+        self.started_at = None
+
+    def check_flag(self, now=None):
+        """Flag the running side if its time is up; return the flagged side or None"""
+        if self.running is None:
+            return None
+        now = time.monotonic() if now is None else now
+        if now - self.started_at >= self.remaining[self.running]:
+            self.flag(self.running)
+            return self.flagged
+        return None
+
+    def deadline(self):
+        """Monotonic time at which the running side flags, or None if stopped"""
+        if self.running is None:
+            return None
+        return self.started_at + self.remaining[self.running]
+
+    def live(self, now=None):
+        """Remaining time for both sides including the running turn"""
+        values = list(self.remaining)
+        if self.running is not None:
+            now = time.monotonic() if now is None else now
+            side = self.running
+            values[side] = max(0.0, values[side] - (now - self.started_at))
+        return values
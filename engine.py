@@ -0,0 +1,583 @@
+import functools
+import random
+import time
+from array import array
+
+import chess
+
+from models import decode_move, encode_move
+from openings import book_move
+from shards import shard_index
+from workers import WorkerPool
+
+# Transposition table slots per engine process; entries are replaced by
+# depth within a search and unconditionally once they are from an old one
+DEFAULT_HASH_ENTRIES = 1 << 17
+# Search depth cap for each bot level, weakest first
+LEVEL_DEPTHS = (1, 2, 3, 5, 64)
+# Longest a bot thinks about one move, whatever its clock says
+MAX_THINK_SECONDS = 10.0
+MIN_THINK_SECONDS = 0.05
+
+MATE_SCORE = 100000
+# Scores beyond this are mates, stored in the table relative to the node
+MATE_BOUND = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+EXACT, LOWER, UPPER = 0, 1, 2
+# Nodes searched between looks at the clock
+TIME_CHECK_NODES = 1024
+
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 0)
+
+# Piece-square bonuses from white's point of view, rank 8 first, so a white
+# piece on square ``sq`` reads index ``sq ^ 56`` and a black one index ``sq``
+# fmt: off
+PAWN_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0,
+)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+)
+KING_TABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20,
+)
+KING_ENDGAME_TABLE = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+# fmt: on
+
+PIECE_TABLES = (
+    None,
+    PAWN_TABLE,
+    KNIGHT_TABLE,
+    BISHOP_TABLE,
+    ROOK_TABLE,
+    QUEEN_TABLE,
+    KING_TABLE,
+)
+
+# Zobrist keys: one per (color, piece type, square), castling corner,
+# en passant file and for black to move. A fixed seed keeps keys, and so
+# table contents, the same in every process.
+_keys = random.Random(0x5EED)
+PIECE_KEYS = [
+    [[_keys.getrandbits(64) for _ in chess.SQUARES] for _ in range(7)]
+    for _ in chess.COLORS
+]
+CASTLING_CORNERS = (chess.A1, chess.H1, chess.A8, chess.H8)
+_corner_keys = [_keys.getrandbits(64) for _ in CASTLING_CORNERS]
+EP_KEYS = [_keys.getrandbits(64) for _ in range(8)]
+BLACK_KEY = _keys.getrandbits(64)
+# Mixed into a position's key to tell searches of different depth caps apart
+# in the analysis cache
+DEPTH_KEYS = [_keys.getrandbits(64) for _ in range(max(LEVEL_DEPTHS) + 1)]
+del _keys
+
+CASTLING_MASK = chess.BB_A1 | chess.BB_H1 | chess.BB_A8 | chess.BB_H8
+# Combined key of every subset of castling corners, by bitboard
+CASTLING_KEYS = {}
+for _subset in range(16):
+    _mask = _key = 0
+    for _i, _corner in enumerate(CASTLING_CORNERS):
+        if _subset >> _i & 1:
+            _mask |= chess.BB_SQUARES[_corner]
+            _key ^= _corner_keys[_i]
+    CASTLING_KEYS[_mask] = _key
+
+
+def state_key(board):
+    """Zobrist key of ``board``'s castling rights, en passant square and turn"""
+    key = CASTLING_KEYS[board.castling_rights & CASTLING_MASK]
+    if board.ep_square is not None:
+        key ^= EP_KEYS[board.ep_square & 7]
+    if board.turn == chess.BLACK:
+        key ^= BLACK_KEY
+    return key
+
+
+def zobrist_key(board):
+    """Zobrist key of ``board`` computed from scratch"""
+    key = state_key(board)
+    for square, piece in board.piece_map().items():
+        key ^= PIECE_KEYS[piece.color][piece.piece_type][square]
+    return key
+
+
+def push_key(board, key, move):
+    """Push ``move`` onto ``board`` and return the new key from the old ``key``"""
+    color = board.turn
+    source, target = move.from_square, move.to_square
+    piece = board.piece_type_at(source)
+    ours, theirs = PIECE_KEYS[color], PIECE_KEYS[not color]
+    key ^= state_key(board) ^ ours[piece][source]
+    key ^= ours[move.promotion or piece][target]
+    victim = board.piece_type_at(target)
+    if victim:
+        key ^= theirs[victim][target]
+    elif piece == chess.PAWN and target == board.ep_square:
+        key ^= theirs[chess.PAWN][target ^ 8]
+    elif piece == chess.KING and abs(target - source) == 2:
+        # Castling: the rook jumps from the corner to the king's other side
+        if target > source:
+            key ^= ours[chess.ROOK][target + 1] ^ ours[chess.ROOK][target - 1]
+        else:
+            key ^= ours[chess.ROOK][target - 2] ^ ours[chess.ROOK][target + 1]
+    board.push(move)
+    return key ^ state_key(board)
+
+
+def evaluate(board):
+    """Material and piece-square score of ``board`` for the side to move"""
+    endgame = not board.queens
+    score = 0
+    for color, flip, sign in ((chess.WHITE, 56, 1), (chess.BLACK, 0, -1)):
+        side = 0
+        for piece in chess.PIECE_TYPES:
+            table = PIECE_TABLES[piece]
+            if piece == chess.KING and endgame:
+                table = KING_ENDGAME_TABLE
+            value = PIECE_VALUES[piece]
+            for square in chess.scan_forward(board.pieces_mask(piece, color)):
+                side += value + table[square ^ flip]
+        score += sign * side
+    return score if board.turn == chess.WHITE else -score
+
+
+class SearchTimeout(Exception):
+    """The search ran out of time; its partial iteration is discarded"""
+
+
+class TranspositionTable:
+    """Fixed number of slots indexed by the low bits of a Zobrist key
+
+    Each slot holds ``(key, depth, flag, score, move, generation)``. A slot
+    written by the current search is only overwritten by an entry searched
+    at least as deep; slots from earlier searches are fair game.
+    """
+
+    def __init__(self, entries=DEFAULT_HASH_ENTRIES):
+        size = 1 << max(entries - 1, 1).bit_length()
+        self.mask = size - 1
+        self.slots = [None] * size
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, key):
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        index = key & self.mask
+        entry = self.slots[index]
+        if (
+            entry is None
+            or entry[5] != self.generation
+            or entry[0] == key
+            or depth >= entry[1]
+        ):
+            self.slots[index] = (key, depth, flag, score, move, self.generation)
+
+
+def _score_to_table(score, ply):
+    # Mates are stored as distance from this node, not from the root
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Search:
+    """Iterative-deepening alpha-beta search of one position
+
+    Negamax with a quiescence search over captures, a transposition table
+    and move ordering by table move, MVV-LVA captures and two killer moves
+    per ply. Positions seen earlier in the game or on the current line
+    score as draws, so the engine neither walks into nor misses repetitions.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def run(self, board, history, time_limit, max_depth=64, first=None):
+        """Best move for ``board`` within ``time_limit`` seconds
+
+        ``history`` holds the keys of earlier positions since the last
+        capture or pawn move; ``first``, if legal, is searched first, as the
+        best move found so far. Returns ``(move, score, depth, nodes)``;
+        ``depth`` is that of the last completed iteration.
+        """
+        self.board = board
+        self.deadline = time.monotonic() + time_limit
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(max_depth + 64)]
+        self.table.new_search()
+        key = zobrist_key(board)
+        self.path = list(history) + [key]
+
+        moves = list(board.legal_moves)
+        if not moves:
+            return None, 0, 0, 0
+        best_move, best_score, completed = moves[0], 0, 0
+        if first in moves:
+            best_move = first
+        if len(moves) == 1:
+            return best_move, best_score, completed, 0
+
+        started = time.monotonic()
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self._root(key, moves, depth, best_move)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed = move, score, depth
+            if abs(score) > MATE_BOUND:
+                break
+            # The next iteration takes several times as long as this one
+            elapsed = time.monotonic() - started
+            if time.monotonic() + 2 * elapsed > self.deadline:
+                break
+        return best_move, best_score, completed, self.nodes
+
+    def _root(self, key, moves, depth, first):
+        board = self.board
+        moves.sort(key=lambda move: move != first)
+        alpha, best_move = -INFINITY, moves[0]
+        for move in moves:
+            child = push_key(board, key, move)
+            self.path.append(child)
+            try:
+                score = -self._negamax(child, depth - 1, -INFINITY, -alpha, 1)
+            finally:
+                self.path.pop()
+                board.pop()
+            if score > alpha:
+                alpha, best_move = score, move
+        self.table.store(key, depth, EXACT, alpha, best_move)
+        return alpha, best_move
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+    def _is_draw(self, key):
+        board = self.board
+        if board.halfmove_clock >= 100:
+            return True
+        # Only positions since the last irreversible move can repeat
+        for earlier in self.path[-board.halfmove_clock - 1 : -1]:
+            if earlier == key:
+                return True
+        return False
+
+    def _negamax(self, key, depth, alpha, beta, ply):
+        self._tick()
+        board = self.board
+        if self._is_draw(key) or board.is_insufficient_material():
+            return 0
+        if depth <= 0:
+            return self._quiesce(alpha, beta, ply)
+
+        original_alpha = alpha
+        table_move = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            table_move = entry[4]
+            if entry[1] >= depth:
+                score = _score_from_table(entry[3], ply)
+                if entry[2] == EXACT:
+                    return score
+                if entry[2] == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        best_score, best_move = -INFINITY, None
+        killers = self.killers[ply]
+        for move in self._ordered(board.legal_moves, table_move, killers):
+            child = push_key(board, key, move)
+            self.path.append(child)
+            try:
+                score = -self._negamax(child, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                self.path.pop()
+                board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not board.is_capture(move) and move != killers[0]:
+                            killers[1], killers[0] = killers[0], move
+                        break
+
+        if best_move is None:
+            return -MATE_SCORE + ply if board.is_check() else 0
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, flag, _score_to_table(best_score, ply), best_move)
+        return best_score
+
+    def _quiesce(self, alpha, beta, ply):
+        self._tick()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self._ordered(board.generate_legal_captures(), None, ()):
+            board.push(move)
+            try:
+                score = -self._quiesce(-beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _ordered(self, moves, table_move, killers):
+        """``moves`` with the table move first, then captures, then killers"""
+        board = self.board
+        scored = []
+        for move in moves:
+            if move == table_move:
+                order = 1 << 20
+            else:
+                victim = board.piece_type_at(move.to_square)
+                if victim or move.promotion:
+                    # Most valuable victim, least valuable attacker
+                    attacker = board.piece_type_at(move.from_square)
+                    order = (
+                        1000
+                        + 10 * (victim or 0)
+                        - attacker
+                        + 100 * bool(move.promotion)
+                    )
+                elif move in killers:
+                    order = 500
+                else:
+                    order = 0
+            scored.append((order, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+
+def replay(packed):
+    """Board after the packed move list, its key and its repeatable history"""
+    board = chess.Board()
+    key = zobrist_key(board)
+    history = []
+    for code in array("H", packed):
+        move = decode_move(code)
+        if board.is_zeroing(move):
+            # Nothing before a capture or pawn move can come back
+            history = []
+        else:
+            history.append(key)
+        key = push_key(board, key, move)
+    board.clear_stack()
+    return board, key, history
+
+
+def think_time(remaining, increment, moves_played):
+    """Seconds to spend on a move with ``remaining`` seconds on the clock"""
+    # Assume about 30 more moves early on, fewer as the game goes
+    moves_to_go = max(30 - moves_played // 4, 15)
+    budget = remaining / moves_to_go + 0.75 * increment
+    budget = min(budget, remaining / 4, MAX_THINK_SECONDS)
+    return max(budget, MIN_THINK_SECONDS)
+
+
+def _engine_handler(hash_entries, cache, book, tablebase):
+    """Request handler for one engine process, keeping its table between moves"""
+    search = Search(TranspositionTable(hash_entries))
+
+    def handle(message):
+        kind, packed, time_limit, max_depth = message
+        board, key, history = replay(packed)
+        if tablebase is not None:
+            move = tablebase.best_move(board)
+            if move is not None:
+                return ("ok", move.uci(), 0, 0, 0, "tablebase")
+        if book is not None:
+            move = book_move(book, board)
+            if move is not None:
+                return ("ok", move.uci(), 0, 0, 0, "book")
+        key ^= DEPTH_KEYS[max_depth]
+        cached = cache.get(key) if cache is not None else None
+        hint = None
+        if cached is not None:
+            move = decode_move(cached[0])
+            # A key collision must not produce an illegal move
+            if board.is_legal(move):
+                _, score, depth = cached
+                # Only a search that reached the depth cap, or found a
+                # mate, is as good as any this one could run
+                if depth >= max_depth or abs(score) > MATE_BOUND:
+                    return ("ok", move.uci(), score, depth, 0, "cache")
+                hint = move
+        move, score, depth, nodes = search.run(
+            board, history, time_limit, max_depth, first=hint
+        )
+        if hint is not None and depth < cached[2]:
+            # Less time than the cached search had: its deeper answer wins
+            return ("ok", hint.uci(), cached[1], cached[2], nodes, "search")
+        if cache is not None and move is not None and depth > 0:
+            cache.put(key, encode_move(move), score, depth)
+        return ("ok", move and move.uci(), score, depth, nodes, "search")
+
+    return handle
+
+
+class EnginePool:
+    """Bot move searches run in ``count`` worker processes
+
+    Games are hashed onto workers like game shards, so each game's searches
+    reuse the transposition table filled by its previous moves. Callers
+    wait on a socket rather than the GIL, so a thinking bot never holds up
+    moves in other games. Endgames covered by the ``tablebase`` are played
+    perfectly from it; otherwise moves come from the opening ``book`` while
+    it has any, then from an AnalysisCache, created before the workers
+    fork and so shared by all of them, for positions already searched to
+    the same depth cap, and only then from a search. A cached search that
+    stopped short of the cap only orders the new search's first move.
+    """
+
+    def __init__(
+        self,
+        count,
+        hash_entries=DEFAULT_HASH_ENTRIES,
+        cache=None,
+        book=None,
+        tablebase=None,
+    ):
+        self.cache = cache
+        # Moves answered by each source
+        self.sources = {"tablebase": 0, "book": 0, "cache": 0, "search": 0}
+        self._workers = WorkerPool(
+            count,
+            functools.partial(_engine_handler, hash_entries, cache, book, tablebase),
+            "engine",
+        )
+
+    def __len__(self):
+        return len(self._workers)
+
+    def search(self, game_id, packed, time_limit, level):
+        """Best move at bot ``level`` after the packed move list, or None if none
+
+        Takes the moves rather than the game so the caller can release the
+        game's lock while the engine thinks.
+        """
+        index = shard_index(game_id, len(self._workers))
+        max_depth = LEVEL_DEPTHS[level - 1]
+        reply = self._workers.call(index, ("search", packed, time_limit, max_depth))
+        self.sources[reply[5]] += 1
+        return None if reply[1] is None else chess.Move.from_uci(reply[1])
+
+    def close(self):
+        self._workers.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search a position")
+    parser.add_argument("fen", nargs="?", default=chess.STARTING_FEN)
+    parser.add_argument("--time", type=float, default=3.0)
+    parser.add_argument("--depth", type=int, default=64)
+    args = parser.parse_args()
+    board = chess.Board(args.fen)
+    started = time.perf_counter()
+    move, score, depth, nodes = Search(TranspositionTable()).run(
+        board, [], args.time, args.depth
+    )
+    elapsed = time.perf_counter() - started
+    print(
+        f"{board.san(move) if move else '-'} score {score} depth {depth} "
+        f"nodes {nodes} in {elapsed:.2f}s ({nodes / elapsed:,.0f} nodes/s)"
+    )
@@ -0,0 +1,601 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+import chess
+
+from models import Game, decode_move
+from outcome import OutcomeTracker, position_key
+from store import GameConflict, MemoryGameStore, _game_meta, _restore_meta
+
+# Every record: <u32 body length> <u32 CRC32 of body>, then a body of
+# <u8 type> <f64 wall time> <u8 game id length> <game id> <payload>. A
+# crash can only tear the last record of a segment, which fails its CRC.
+RECORD_HEADER = struct.Struct("<II")
+BODY_HEADER = struct.Struct("<BdB")
+
+# Records whose payload is a whole game: <u16 metadata length>
+# <u16 repetition count> <u8 occurrences of the current position>, the
+# board's bitboards, <metadata JSON> <u64 position key, u8 count>...
+# <moves as little-endian u16 codes>
+CREATE = 1
+STATE = 2
+RESET = 3
+RESULT = 4
+# <u16 ply> <u16 move code> <captured counters> <f64 white left>
+# <f64 black left> <i8 running side or -1> <f64 wall time it started>
+MOVE = 5
+DISCARD = 6
+RECORD_NAMES = {
+    CREATE: "create",
+    STATE: "state",
+    RESET: "reset",
+    RESULT: "result",
+    MOVE: "move",
+    DISCARD: "discard",
+}
+
+GAME_HEADER = struct.Struct("<HHB")
+# Piece bitboards, white and black squares, promoted pieces, side to move,
+# castling rights, en passant square (-1 for none), halfmove and move number
+BOARD = struct.Struct("<9QBQbHH")
+REPETITION = struct.Struct("<QB")
+MOVE_RECORD = struct.Struct("<HH10sddbd")
+
+# Snapshot file: <4s magic> <u32 format> <u64 first segment to replay after
+# it>, then one CREATE record per live game
+SNAPSHOT_HEADER = struct.Struct("<4sIQ")
+SNAPSHOT_MAGIC = b"CHJS"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_NAME = "snapshot"
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_COMPACT_BYTES = 64 << 20
+
+
+def _pack_board(board):
+    return BOARD.pack(
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        board.occupied_co[chess.WHITE],
+        board.occupied_co[chess.BLACK],
+        board.promoted,
+        board.turn,
+        board.castling_rights,
+        -1 if board.ep_square is None else board.ep_square,
+        board.halfmove_clock,
+        board.fullmove_number,
+    )
+
+
+def _unpack_board(payload, offset):
+    """Inverse of ``_pack_board``; parsing a FEN takes twenty times longer"""
+    board = chess.Board.empty()
+    (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        white,
+        black,
+        board.promoted,
+        turn,
+        board.castling_rights,
+        ep_square,
+        board.halfmove_clock,
+        board.fullmove_number,
+    ) = BOARD.unpack_from(payload, offset)
+    board.occupied_co[chess.WHITE] = white
+    board.occupied_co[chess.BLACK] = black
+    board.occupied = white | black
+    board.turn = bool(turn)
+    board.ep_square = None if ep_square < 0 else ep_square
+    return board
+
+
+def _encode_game(game):
+    """A game record's payload: board, metadata, repetition counts and moves"""
+    meta = json.dumps(_game_meta(game), separators=(",", ":")).encode("utf-8")
+    repetitions = game.outcome.repetitions
+    count = min(repetitions.get(position_key(game.board), 1), 255)
+    moves = game.moves
+    if sys.byteorder == "big":
+        moves = array("H", moves)
+        moves.byteswap()
+    return b"".join(
+        [
+            GAME_HEADER.pack(len(meta), len(repetitions), count),
+            _pack_board(game.board),
+            meta,
+        ]
+        + [REPETITION.pack(key, min(seen, 255)) for key, seen in repetitions.items()]
+        + [moves.tobytes()]
+    )
+
+
+def _decode_game(game_id, payload):
+    """Inverse of ``_encode_game``; the board is restored, not replayed"""
+    meta_length, repetition_count, count = GAME_HEADER.unpack_from(payload)
+    board = _unpack_board(payload, GAME_HEADER.size)
+    start = GAME_HEADER.size + BOARD.size
+    meta = json.loads(bytes(payload[start : start + meta_length]))
+    start += meta_length
+    end = start + repetition_count * REPETITION.size
+    repetitions = dict(REPETITION.iter_unpack(payload[start:end]))
+    moves = array("H")
+    moves.frombytes(payload[end:])
+    if sys.byteorder == "big":
+        moves.byteswap()
+
+    game = Game(game_id, meta["time_control"], None, None)
+    game.board = board
+    game.outcome = OutcomeTracker.restore(board, repetitions, count)
+    game.moves = moves
+    _restore_meta(game, meta)
+    return game
+
+
+def _encode_move(game):
+    """A MOVE record's payload for ``game``'s last move"""
+    clock = game.clock
+    to_wall = time.time() - time.monotonic()
+    return MOVE_RECORD.pack(
+        len(game.moves),
+        game.moves[-1],
+        bytes(game.captured),
+        clock.remaining[0],
+        clock.remaining[1],
+        -1 if clock.running is None else clock.running,
+        0.0 if clock.started_at is None else clock.started_at + to_wall,
+    )
+
+
+def _apply_move(game, payload, to_monotonic):
+    """Replay a MOVE record unless ``game`` already has that ply"""
+    ply, code, captured, white, black, running, started_at = MOVE_RECORD.unpack_from(
+        payload
+    )
+    if len(game.moves) != ply - 1:
+        # Written while a snapshot that already holds it was being taken
+        return
+    game.push(decode_move(code))
+    game.captured = bytearray(captured)
+    clock = game.clock
+    clock.remaining = [white, black]
+    if running < 0:
+        clock.running = clock.started_at = None
+    else:
+        clock.running = running
+        clock.started_at = started_at + to_monotonic
+
+
+def _state_key(game):
+    """What a STATE record captures apart from moves and clock times"""
+    return (
+        tuple(game.players),
+        tuple(game.usernames),
+        game.result,
+        game.opening,
+        game.clock.flagged,
+        tuple(
+            None if dc is None else (dc.disconnected_at, dc.expired)
+            for dc in game.disconnected_players
+        ),
+    )
+
+
+def _records(data, path):
+    """Yield the bodies of the records in ``data``, stopping at a torn one"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + RECORD_HEADER.size > len(view):
+            body = None
+        else:
+            length, crc = RECORD_HEADER.unpack_from(view, offset)
+            start = offset + RECORD_HEADER.size
+            body = view[start : start + length]
+            if len(body) != length or zlib.crc32(body) != crc:
+                body = None
+        if body is None:
+            print(f"Journal {path} ends in a torn record at byte {offset}, skipped")
+            return
+        yield body
+        offset = start + length
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GameJournal:
+    """Append-only log of game changes in ``directory``, for crash recovery
+
+    Creates, joins, disconnects and results are logged as whole-game
+    records, moves as 63-byte deltas. Records are buffered and a writer
+    thread appends and fsyncs them once per ``flush_interval`` seconds, so
+    one fsync covers every change made in that window (0 writes and syncs
+    each change before returning). Once the segments hold more than
+    ``compact_bytes``, the writer starts a new segment, writes every game
+    from ``snapshot_source()`` to a snapshot and deletes the older
+    segments, so recovery reads one snapshot plus a bounded tail.
+    """
+
+    def __init__(
+        self,
+        directory,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        compact_bytes=DEFAULT_COMPACT_BYTES,
+        snapshot_source=None,
+    ):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_bytes = compact_bytes
+        # Returns an iterable of the live games; it must hold each game's
+        # lock while the game is being written
+        self.snapshot_source = snapshot_source
+        self.stats = {
+            "records": 0,
+            "bytes": 0,
+            "fsyncs": 0,
+            "compactions": 0,
+            "compaction_seconds": 0.0,
+            "recovered_games": 0,
+            "recovery_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._shadow = {}
+        self._fd = None
+        self._segment = 0
+        # Bytes in the segments a recovery would replay after the snapshot
+        self._log_bytes = 0
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, seq):
+        return os.path.join(
+            self.directory, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}"
+        )
+
+    def _segments(self):
+        """Sequence numbers of the segment files on disk, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                found.append(int(name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)]))
+        return sorted(found)
+
+    def _open_segment(self, seq):
+        """Direct appends to a new segment; caller must hold ``_write_lock``"""
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(
+            self._segment_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        self._segment = seq
+        _fsync_directory(self.directory)
+
+    def recover(self):
+        """Rebuild the logged games as ``{game_id: Game}`` and start a new segment
+
+        Must be called once, before anything is logged. Clocks, players and
+        reconnect windows come back exactly as last logged.
+        """
+        started = time.perf_counter()
+        to_monotonic = time.monotonic() - time.time()
+        games = {}
+        first = 0
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, version, first = SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+                raise ValueError(f"{path} is not a format {SNAPSHOT_FORMAT} snapshot")
+            for body in _records(data[SNAPSHOT_HEADER.size :], path):
+                self._replay(body, games, to_monotonic)
+
+        segments = self._segments()
+        for seq in segments:
+            if seq < first:
+                continue
+            path = self._segment_path(seq)
+            with open(path, "rb") as f:
+                data = f.read()
+            self._log_bytes += len(data)
+            for body in _records(data, path):
+                self._replay(body, games, to_monotonic)
+
+        for game in games.values():
+            self._shadow[game.game_id] = (game.moves, len(game.moves), _state_key(game))
+        # Never append after a torn tail: every start gets a new segment
+        with self._write_lock:
+            self._open_segment(max(segments[-1] + 1 if segments else 0, first))
+        self.stats["recovered_games"] = len(games)
+        self.stats["recovery_seconds"] = time.perf_counter() - started
+        return games
+
+    def _replay(self, body, games, to_monotonic):
+        kind, stamp, id_length = BODY_HEADER.unpack_from(body)
+        start = BODY_HEADER.size
+        game_id = bytes(body[start : start + id_length]).decode("utf-8")
+        payload = body[start + id_length :]
+        if kind == DISCARD:
+            games.pop(game_id, None)
+        elif kind == MOVE:
+            game = games.get(game_id)
+            if game is not None:
+                _apply_move(game, payload, to_monotonic)
+                game.last_activity = stamp + to_monotonic
+        elif kind in RECORD_NAMES:
+            games[game_id] = _decode_game(game_id, payload)
+        else:
+            print(f"Unknown journal record type {kind} for game {game_id}, skipped")
+
+    def _append(self, kind, game_id, payload):
+        encoded_id = game_id.encode("utf-8")
+        body = BODY_HEADER.pack(kind, time.time(), len(encoded_id)) + encoded_id
+        body += payload
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+        with self._lock:
+            self._pending.append(record)
+            if self._writer is None and not self._closed:
+                self._writer = threading.Thread(
+                    target=self._writer_loop, name="game-journal", daemon=True
+                )
+                self._writer.start()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def created(self, game):
+        """Log a new game"""
+        self._append(CREATE, game.game_id, _encode_game(game))
+        self._shadow[game.game_id] = (game.moves, len(game.moves), _state_key(game))
+
+    def saved(self, game):
+        """Log whatever changed in ``game`` since it was last logged"""
+        shadow = self._shadow.get(game.game_id)
+        key = _state_key(game)
+        if shadow is None or shadow[0] is not game.moves or shadow[1] > len(game.moves):
+            # ``Game.reset`` starts a new move list
+            kind = STATE if shadow is None else RESET
+            self._append(kind, game.game_id, _encode_game(game))
+        else:
+            if shadow[1] < len(game.moves):
+                self._append(MOVE, game.game_id, _encode_move(game))
+            if key != shadow[2]:
+                kind = RESULT if shadow[2][2] is None and game.result else STATE
+                self._append(kind, game.game_id, _encode_game(game))
+        self._shadow[game.game_id] = (game.moves, len(game.moves), key)
+
+    def discarded(self, game_id):
+        """Log that a game is gone"""
+        self._shadow.pop(game_id, None)
+        self._append(DISCARD, game_id, b"")
+
+    def flush(self):
+        """Append the buffered records and fsync them together"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch or self._fd is None:
+                return
+            data = b"".join(batch)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view) :]
+            os.fsync(self._fd)
+            self._log_bytes += len(data)
+            self.stats["records"] += len(batch)
+            self.stats["bytes"] += len(data)
+            self.stats["fsyncs"] += 1
+
+    def compact(self):
+        """Snapshot every live game and drop the segments it replaces"""
+        if self.snapshot_source is None:
+            return
+        started = time.perf_counter()
+        # Changes logged from here on land in the new segment; replaying
+        # them over a snapshot that already has them is harmless
+        self.flush()
+        with self._write_lock:
+            first = self._segment + 1
+            self._open_segment(first)
+            self._log_bytes = 0
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        tmp_path = path + ".tmp"
+        count = 0
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, first))
+            for game in self.snapshot_source():
+                encoded_id = game.game_id.encode("utf-8")
+                body = BODY_HEADER.pack(CREATE, time.time(), len(encoded_id))
+                body += encoded_id + _encode_game(game)
+                f.write(RECORD_HEADER.pack(len(body), zlib.crc32(body)))
+                f.write(body)
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_directory(self.directory)
+        for seq in self._segments():
+            if seq < first:
+                os.unlink(self._segment_path(seq))
+        elapsed = time.perf_counter() - started
+        self.stats["compactions"] += 1
+        self.stats["compaction_seconds"] = elapsed
+        print(f"Journal compacted: {count} games snapshotted in {elapsed:.2f}s")
+
+    def _writer_loop(self):
+        while not self._closed:
+            # With write-through flushing the thread only checks for compaction
+            self._wakeup.wait(self.flush_interval if self.flush_interval > 0 else 1.0)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self._log_bytes >= self.compact_bytes:
+                    self.compact()
+            except OSError as e:
+                print(f"Failed to write game journal: {e}")
+
+    def close(self):
+        """Stop the writer and flush whatever is still buffered"""
+        self._closed = True
+        self._wakeup.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=max(self.flush_interval, 1.0) + 5)
+        self.flush()
+        with self._write_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class JournaledGameStore(MemoryGameStore):
+    """Games held in this process and logged to a GameJournal
+
+    The games left in the journal are recovered when the store is created.
+    """
+
+    def __init__(self, journal):
+        super().__init__()
+        self.journal = journal
+        self._games = journal.recover()
+
+    def __iter__(self):
+        return iter(list(self._games))
+
+    def add(self, game):
+        """Store and log a new game; GameConflict if the id is taken"""
+        if game.game_id in self._games:
+            raise GameConflict(game.game_id)
+        self._games[game.game_id] = game
+        self.journal.created(game)
+
+    def save(self, game):
+        self.journal.saved(game)
+
+    def discard(self, game_id):
+        """Remove and log a game and return it, or None if it was already gone"""
+        game = self._games.pop(game_id, None)
+        if game is not None:
+            self.journal.discarded(game_id)
+        return game
+
+
+def _bench(games, tail_moves, seed=1):
+    """Seconds to recover ``games`` games from the log alone, to compact
+    them into a snapshot, and to recover from the snapshot
+
+    Every game is logged as created ``tail_moves`` moves before the end of
+    one of a few dozen random games, then as those moves.
+    """
+    import random
+    import shutil
+    import tempfile
+
+    rng = random.Random(seed)
+    templates = []
+    for _ in range(64):
+        board = chess.Board()
+        line = []
+        plies = rng.randrange(30, 90)
+        while len(line) < plies and not board.is_game_over():
+            line.append(rng.choice(list(board.legal_moves)))
+            board.push(line[-1])
+        head = max(len(line) - tail_moves, 0)
+        game = Game("BENCH", "10+5", "white", "White")
+        game.players[1], game.usernames[1] = "black", "Black"
+        game.clock.start(0)
+        tail = []
+        for ply, move in enumerate(line, 1):
+            game.push(move)
+            game.clock.press(1 - game.current_player)
+            if ply == head:
+                image = _encode_game(game)
+            elif ply > head:
+                tail.append(_encode_move(game))
+        if head == 0:
+            image = None
+        templates.append((image, tail))
+    templates = [t for t in templates if t[0] is not None]
+
+    directory = tempfile.mkdtemp(prefix="journal-bench-")
+    try:
+        journal = GameJournal(directory, flush_interval=3600)
+        journal.recover()
+        for i in range(games):
+            image, tail = templates[i % len(templates)]
+            game_id = f"G{i:07d}"
+            journal._append(CREATE, game_id, image)
+            for payload in tail:
+                journal._append(MOVE, game_id, payload)
+        journal.close()
+        log_bytes = sum(
+            os.path.getsize(journal._segment_path(seq)) for seq in journal._segments()
+        )
+
+        journal = GameJournal(directory)
+        store = JournaledGameStore(journal)
+        assert len(store) == games
+        from_log = journal.stats["recovery_seconds"]
+        journal.snapshot_source = lambda: (store.get(game_id) for game_id in store)
+        journal.compact()
+        compaction = journal.stats["compaction_seconds"]
+        journal.close()
+        snapshot_bytes = os.path.getsize(os.path.join(directory, SNAPSHOT_NAME))
+
+        journal = GameJournal(directory)
+        store = JournaledGameStore(journal)
+        assert len(store) == games
+        from_snapshot = journal.stats["recovery_seconds"]
+        journal.close()
+    finally:
+        shutil.rmtree(directory)
+    return from_log, log_bytes, compaction, from_snapshot, snapshot_bytes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark game journal recovery")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument(
+        "--tail-moves",
+        type=int,
+        default=10,
+        help="moves logged per game after its create record",
+    )
+    args = parser.parse_args()
+    from_log, log_bytes, compaction, from_snapshot, snapshot_bytes = _bench(
+        args.games, args.tail_moves
+    )
+    print(
+        f"Recovered {args.games} games from {log_bytes / 1e6:.1f} MB of log "
+        f"in {from_log:.2f}s"
+    )
+    print(
+        f"Compacted into a {snapshot_bytes / 1e6:.1f} MB snapshot in {compaction:.2f}s"
+    )
+    print(f"Recovered them from the snapshot in {from_snapshot:.2f}s")
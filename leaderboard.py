@@ -0,0 +1,590 @@
+import copy
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from sortedcontainers import SortedList
+
+
+def _new_player():
+    return {"wins": 0, "losses": 0, "total_games": 0}
+
+
+def _core_stats(stats):
+    return {
+        "wins": stats.get("wins", 0),
+        "losses": stats.get("losses", 0),
+        "draws": stats.get("draws", 0),
+        "total_games": stats.get("total_games", 0),
+    }
+
+
+class RankIndex:
+    """Players ordered by wins (desc), then total games (asc), then name
+
+    Kept in a sorted list so a result only costs an O(log N) remove/insert
+    and top-N, rank lookups and windows never re-sort the leaderboard.
+    """
+
+    def __init__(self, leaderboard=None):
+        self._keys = {}
+        self._ranked = SortedList()
+        for name, stats in (leaderboard or {}).items():
+            self.update(name, stats)
+
+    @staticmethod
+    def _key(name, stats):
+        return (-stats.get("wins", 0), stats.get("total_games", 0), name)
+
+    def __len__(self):
+        return len(self._ranked)
+
+    def update(self, name, stats):
+        """Re-rank ``name`` after its stats changed"""
+        key = self._key(name, stats)
+        old_key = self._keys.get(name)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._ranked.remove(old_key)
+        self._ranked.add(key)
+        self._keys[name] = key
+
+    def names(self, offset, limit):
+        """Return player names ranked ``offset + 1`` to ``offset + limit``"""
+        stop = None if limit is None else offset + limit
+        return [key[2] for key in self._ranked.islice(offset, stop)]
+
+    def rank(self, name):
+        """Return the 1-based rank of ``name``, or None"""
+        key = self._keys.get(name)
+        if key is None:
+            return None
+        return self._ranked.bisect_left(key) + 1
+
+
+class LeaderboardStore:
+    """In-memory leaderboard that persists to a JSON file in the background
+
+    Results are applied to the in-memory dict immediately and a single writer
+    thread flushes the whole file at most once per ``flush_interval`` seconds,
+    replacing it atomically so a crash mid-write never leaves a torn file.
+    A ``flush_interval`` of 0 writes through on every result.
+    """
+
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._data = self._read_file()
+        self._index = RankIndex(self._data)
+        self._dirty = False
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._writer = None
+
+    def _read_file(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _write_file(self, payload):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".leaderboard-", suffix=".tmp", dir=directory
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _mark_dirty(self):
+        """Schedule a flush; caller must hold ``self._lock``"""
+        self._dirty = True
+        if self.flush_interval <= 0 or self._closed:
+            return
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._writer_loop, name="leaderboard-writer", daemon=True
+            )
+            self._writer.start()
+
+    def _writer_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Leaderboard flush failed: {e}")
+
+    def _player(self, name):
+        if name not in self._data:
+            self._data[name] = _new_player()
+        return self._data[name]
+
+    def top(self, n):
+        """Return the top ``n`` players (all if None) as ``[(name, stats), ...]``"""
+        with self._lock:
+            return [
+                (name, copy.deepcopy(self._data[name]))
+                for name in self._index.names(0, n)
+            ]
+
+    def around(self, name, radius):
+        """Return the page of players ranked within ``radius`` of ``name``"""
+        rank = self.rank(name)
+        if rank is None:
+            return None
+        offset = max(0, rank - 1 - radius)
+        return self.page(offset, rank - offset + radius)
+
+    def page(self, offset, limit):
+        """Return ``(total, [(rank, name, stats), ...])`` for one page"""
+        with self._lock:
+            names = self._index.names(offset, limit)
+            return len(self._index), [
+                (offset + i + 1, name, _core_stats(self._data[name]))
+                for i, name in enumerate(names)
+            ]
+
+    def rank(self, name):
+        """Return the 1-based rank of ``name``, or None"""
+        with self._lock:
+            return self._index.rank(name)
+
+    def snapshot(self):
+        """Return a deep copy of the whole leaderboard"""
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def get_player(self, name):
+        """Return a copy of one player's stats, or None"""
+        with self._lock:
+            stats = self._data.get(name)
+            return copy.deepcopy(stats) if stats is not None else None
+
+    def record_win(
+        self, winner_name, loser_name, head_to_head=True, reason=None, duration=None
+    ):
+        """Record a decisive result"""
+        with self._lock:
+            winner = self._player(winner_name)
+            loser = self._player(loser_name)
+
+            winner["wins"] += 1
+            winner["total_games"] += 1
+            loser["losses"] += 1
+            loser["total_games"] += 1
+
+            self._index.update(winner_name, winner)
+            self._index.update(loser_name, loser)
+
+            if head_to_head:
+                h2h_key = f"{winner_name}_vs_{loser_name}"
+                winner.setdefault(h2h_key, {"wins": 0, "losses": 0})["wins"] += 1
+                h2h_key_reverse = f"{loser_name}_vs_{winner_name}"
+                loser.setdefault(h2h_key_reverse, {"wins": 0, "losses": 0})[
+                    "losses"
+                ] += 1
+
+            self._mark_dirty()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def record_draw(self, usernames, reason=None, duration=None):
+        """Record a drawn game for every named player"""
+        with self._lock:
+            for username in usernames:
+                if not username:
+                    continue
+                stats = self._player(username)
+                stats["draws"] = stats.get("draws", 0) + 1
+                stats["total_games"] += 1
+                self._index.update(username, stats)
+            self._mark_dirty()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def flush(self):
+        """Write pending changes to disk if there are any"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                payload = json.dumps(self._data, indent=2)
+                self._dirty = False
+            try:
+                self._write_file(payload)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def close(self):
+        """Stop the background writer and flush whatever is still pending"""
+        self._closed = True
+        self._wakeup.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+# Bumped when SCHEMA changes in a way CREATE ... IF NOT EXISTS cannot apply
+# to an existing database; MIGRATIONS[v] brings version v up to v + 1
+SCHEMA_VERSION = 1
+MIGRATIONS = {
+    # idx_players_wins gained the name that breaks ties
+    0: "DROP INDEX IF EXISTS idx_players_wins",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    total_games INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_players_wins ON players (wins DESC, total_games, name);
+CREATE INDEX IF NOT EXISTS idx_players_total_games ON players (total_games);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    player_a INTEGER NOT NULL REFERENCES players (id),
+    player_b INTEGER NOT NULL REFERENCES players (id),
+    outcome TEXT NOT NULL,
+    reason TEXT,
+    duration REAL,
+    played_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_player_a ON results (player_a);
+CREATE INDEX IF NOT EXISTS idx_results_player_b ON results (player_b);
+
+CREATE TABLE IF NOT EXISTS head_to_head (
+    player_id INTEGER NOT NULL REFERENCES players (id),
+    opponent_id INTEGER NOT NULL REFERENCES players (id),
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, opponent_id)
+) WITHOUT ROWID;
+"""
+
+# Statements are kept as module constants so sqlite3's per-connection
+# statement cache always hits and each one is only prepared once.
+SQL_INSERT_PLAYER = "INSERT OR IGNORE INTO players (name) VALUES (?)"
+SQL_PLAYER_ID = "SELECT id FROM players WHERE name = ?"
+SQL_ADD_WIN = "UPDATE players SET wins = wins + 1, total_games = total_games + 1 WHERE id = ?"
+SQL_ADD_LOSS = "UPDATE players SET losses = losses + 1, total_games = total_games + 1 WHERE id = ?"
+SQL_ADD_DRAW = "UPDATE players SET draws = draws + 1, total_games = total_games + 1 WHERE id = ?"
+SQL_INSERT_RESULT = (
+    "INSERT INTO results (player_a, player_b, outcome, reason, duration, played_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_H2H_WIN = (
+    "INSERT INTO head_to_head (player_id, opponent_id, wins) VALUES (?, ?, 1) "
+    "ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = wins + 1"
+)
+SQL_H2H_LOSS = (
+    "INSERT INTO head_to_head (player_id, opponent_id, losses) VALUES (?, ?, 1) "
+    "ON CONFLICT (player_id, opponent_id) DO UPDATE SET losses = losses + 1"
+)
+SQL_PLAYER_STATS = (
+    "SELECT id, wins, losses, draws, total_games FROM players WHERE name = ?"
+)
+SQL_PLAYER_H2H = (
+    "SELECT o.name, h.wins, h.losses FROM head_to_head h "
+    "JOIN players o ON o.id = h.opponent_id WHERE h.player_id = ?"
+)
+SQL_TOP = (
+    "SELECT name, wins, losses, draws, total_games FROM players "
+    "ORDER BY wins DESC, total_games, name LIMIT ?"
+)
+SQL_PAGE = (
+    "SELECT name, wins, losses, draws, total_games FROM players "
+    "ORDER BY wins DESC, total_games, name LIMIT ? OFFSET ?"
+)
+SQL_COUNT_PLAYERS = "SELECT COUNT(*) FROM players"
+SQL_RANK_KEYS = "SELECT name, wins, total_games FROM players"
+SQL_RANK_KEY = "SELECT name, wins, total_games FROM players WHERE id = ?"
+SQL_LAST_RESULT = "SELECT COALESCE(MAX(id), 0) FROM results"
+SQL_RESULTS_SINCE = (
+    "SELECT id, player_a, player_b FROM results WHERE id > ? ORDER BY id"
+)
+SQL_DATA_VERSION = "PRAGMA data_version"
+SQL_ALL_PLAYERS = (
+    "SELECT id, name, wins, losses, draws, total_games FROM players "
+    "ORDER BY wins DESC, total_games"
+)
+SQL_ALL_H2H = "SELECT player_id, opponent_id, wins, losses FROM head_to_head"
+
+
+def _stats(wins, losses, draws, total_games):
+    return {"wins": wins, "losses": losses, "draws": draws, "total_games": total_games}
+
+
+class SQLiteLeaderboardStore:
+    """Leaderboard backed by an SQLite database in WAL mode
+
+    Players, individual results and head-to-head records live in separate
+    tables, so top-N is an indexed ``LIMIT`` query and rivalries no longer
+    bloat the player rows. Every result is committed immediately. Ranks
+    come from a RankIndex loaded at startup; results other processes
+    commit are found through ``PRAGMA data_version`` and re-rank only their
+    players.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, cached_statements=64
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate()
+        with self._lock:
+            self._load_index()
+
+    def _migrate(self):
+        """Create the schema, first upgrading a database made by older code"""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in range(version, SCHEMA_VERSION):
+            self._conn.execute(MIGRATIONS[step])
+        self._conn.executescript(SCHEMA)
+        if version < SCHEMA_VERSION:
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _load_index(self):
+        """Rank every player afresh; caller holds ``_lock``"""
+        self._data_version = self._conn.execute(SQL_DATA_VERSION).fetchone()[0]
+        self._last_result = self._conn.execute(SQL_LAST_RESULT).fetchone()[0]
+        self._index = RankIndex()
+        for name, wins, total_games in self._conn.execute(SQL_RANK_KEYS):
+            self._index.update(name, {"wins": wins, "total_games": total_games})
+
+    def _rerank(self, player_ids):
+        """Re-read the players' rank keys after a result; caller holds ``_lock``"""
+        for player_id in player_ids:
+            row = self._conn.execute(SQL_RANK_KEY, (player_id,)).fetchone()
+            if row is not None:
+                name, wins, total_games = row
+                self._index.update(name, {"wins": wins, "total_games": total_games})
+
+    def _sync_index(self):
+        """Re-rank players other processes recorded results for; caller
+        holds ``_lock``"""
+        version = self._conn.execute(SQL_DATA_VERSION).fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        rows = self._conn.execute(SQL_RESULTS_SINCE, (self._last_result,)).fetchall()
+        if not rows:
+            # Changed without a result row (a single-player draw, or a
+            # checkpoint): rare enough to re-rank everyone
+            self._load_index()
+            return
+        self._last_result = rows[-1][0]
+        self._rerank({player for _, a, b in rows for player in (a, b)})
+
+    def _player_id(self, name):
+        self._conn.execute(SQL_INSERT_PLAYER, (name,))
+        return self._conn.execute(SQL_PLAYER_ID, (name,)).fetchone()[0]
+
+    def record_win(
+        self, winner_name, loser_name, head_to_head=True, reason=None, duration=None
+    ):
+        """Record a decisive result"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            winner_id = self._player_id(winner_name)
+            loser_id = self._player_id(loser_name)
+            self._conn.execute(SQL_ADD_WIN, (winner_id,))
+            self._conn.execute(SQL_ADD_LOSS, (loser_id,))
+            self._conn.execute(
+                SQL_INSERT_RESULT,
+                (winner_id, loser_id, "win", reason, duration, time.time()),
+            )
+            if head_to_head:
+                self._conn.execute(SQL_H2H_WIN, (winner_id, loser_id))
+                self._conn.execute(SQL_H2H_LOSS, (loser_id, winner_id))
+            self._rerank((winner_id, loser_id))
+
+    def record_draw(self, usernames, reason=None, duration=None):
+        """Record a drawn game for every named player"""
+        names = [name for name in usernames if name]
+        if not names:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            ids = [self._player_id(name) for name in names]
+            for player_id in ids:
+                self._conn.execute(SQL_ADD_DRAW, (player_id,))
+            if len(ids) == 2:
+                self._conn.execute(
+                    SQL_INSERT_RESULT,
+                    (ids[0], ids[1], "draw", reason, duration, time.time()),
+                )
+            self._rerank(ids)
+
+    def around(self, name, radius):
+        """Return the page of players ranked within ``radius`` of ``name``"""
+        rank = self.rank(name)
+        if rank is None:
+            return None
+        offset = max(0, rank - 1 - radius)
+        return self.page(offset, rank - offset + radius)
+
+    def get_player(self, name):
+        """Return one player's stats including head-to-head records, or None"""
+        with self._lock:
+            row = self._conn.execute(SQL_PLAYER_STATS, (name,)).fetchone()
+            if row is None:
+                return None
+            player_id, *counts = row
+            stats = _stats(*counts)
+            for opponent, wins, losses in self._conn.execute(
+                SQL_PLAYER_H2H, (player_id,)
+            ):
+                stats[f"{name}_vs_{opponent}"] = {"wins": wins, "losses": losses}
+            return stats
+
+    def top(self, n):
+        """Return the top ``n`` players (all if None) as ``[(name, stats), ...]``"""
+        with self._lock:
+            rows = self._conn.execute(SQL_TOP, (-1 if n is None else n,)).fetchall()
+        return [(name, _stats(*counts)) for name, *counts in rows]
+
+    def page(self, offset, limit):
+        """Return ``(total, [(rank, name, stats), ...])`` for one page"""
+        with self._lock:
+            total = self._conn.execute(SQL_COUNT_PLAYERS).fetchone()[0]
+            rows = self._conn.execute(SQL_PAGE, (limit, offset)).fetchall()
+        return total, [
+            (offset + i + 1, name, _stats(*counts))
+            for i, (name, *counts) in enumerate(rows)
+        ]
+
+    def rank(self, name):
+        """Return the 1-based rank of ``name``, or None"""
+        with self._lock:
+            self._sync_index()
+            return self._index.rank(name)
+
+    def snapshot(self):
+        """Return the whole leaderboard in the legacy JSON layout"""
+        with self._lock:
+            players = self._conn.execute(SQL_ALL_PLAYERS).fetchall()
+            h2h = self._conn.execute(SQL_ALL_H2H).fetchall()
+        names = {player_id: name for player_id, name, *_ in players}
+        leaderboard = {name: _stats(*counts) for _, name, *counts in players}
+        for player_id, opponent_id, wins, losses in h2h:
+            name = names[player_id]
+            leaderboard[name][f"{name}_vs_{names[opponent_id]}"] = {
+                "wins": wins,
+                "losses": losses,
+            }
+        return leaderboard
+
+    def flush(self):
+        """Checkpoint the WAL into the main database file"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        """Checkpoint and close the database connection"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+
+def migrate_json_to_sqlite(json_path, db_path):
+    """Copy a legacy ``leaderboard.json`` into an empty SQLite database
+
+    Returns the number of players migrated. Individual results were never
+    stored in the JSON file, so only totals and head-to-head records move.
+    """
+    with open(json_path, "r") as f:
+        leaderboard = json.load(f)
+
+    store = SQLiteLeaderboardStore(db_path)
+    conn = store._conn
+    try:
+        with store._lock, conn:
+            if conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]:
+                raise ValueError(f"{db_path} already contains players")
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO players (name, wins, losses, draws, total_games) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        name,
+                        stats.get("wins", 0),
+                        stats.get("losses", 0),
+                        stats.get("draws", 0),
+                        stats.get("total_games", 0),
+                    )
+                    for name, stats in leaderboard.items()
+                ],
+            )
+            ids = dict(conn.execute("SELECT name, id FROM players"))
+            rows = []
+            for name, stats in leaderboard.items():
+                prefix = f"{name}_vs_"
+                for key, record in stats.items():
+                    if not key.startswith(prefix) or not isinstance(record, dict):
+                        continue
+                    opponent_id = ids.get(key[len(prefix):])
+                    if opponent_id is None:
+                        continue
+                    rows.append(
+                        (
+                            ids[name],
+                            opponent_id,
+                            record.get("wins", 0),
+                            record.get("losses", 0),
+                        )
+                    )
+            conn.executemany(
+                "INSERT INTO head_to_head (player_id, opponent_id, wins, losses) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+    finally:
+        store.close()
+    return len(leaderboard)
+
+
+def open_leaderboard(backend, json_path, db_path, flush_interval=5.0):
+    """Create the leaderboard store for ``backend`` ("json" or "sqlite")"""
+    if backend == "json":
+        return LeaderboardStore(json_path, flush_interval=flush_interval)
+    if backend == "sqlite":
+        if not os.path.exists(db_path) and os.path.exists(json_path):
+            count = migrate_json_to_sqlite(json_path, db_path)
+            print(f"Migrated {count} players from {json_path} to {db_path}")
+        return SQLiteLeaderboardStore(db_path)
+    raise ValueError(f"Unknown leaderboard backend: {backend}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("Usage: python leaderboard.py migrate <leaderboard.json> <leaderboard.db>")
+        sys.exit(2)
+    migrated = migrate_json_to_sqlite(sys.argv[2], sys.argv[3])
+    print(f"Migrated {migrated} players from {sys.argv[2]} to {sys.argv[3]}")
@@ -0,0 +1,318 @@
+import heapq
+import itertools
+import threading
+import time
+
+from sortedcontainers import SortedList
+
+# Rating difference a new seek accepts, points its band widens by per second
+# of waiting, and the widest it gets
+DEFAULT_BAND = 50.0
+DEFAULT_WIDEN_RATE = 10.0
+DEFAULT_MAX_BAND = 400.0
+# Candidate pairs looked at per timer callback, so seeks are not held up
+# by a long sweep
+SWEEP_BATCH = 128
+
+
+class Seek:
+    """A player waiting for an opponent"""
+
+    __slots__ = ("key", "rating", "bucket", "since", "seq", "data")
+
+    def __init__(self, key, rating, bucket, since, seq, data):
+        self.key = key
+        self.rating = rating
+        self.bucket = bucket
+        self.since = since
+        self.seq = seq
+        self.data = data
+
+
+class Matchmaker:
+    """Pairs players seeking a game by time control and rating
+
+    Each bucket (time control) queues its seeks in a SortedList ordered by
+    rating. Two seeks match when their ratings differ by no more than
+    either's band, which starts at ``band`` and widens by ``widen_rate``
+    points per second of waiting, up to ``max_band``. A new seek takes its
+    nearest rating neighbour if that one is within its band, found by
+    bisection, so a seek costs O(log n) whatever the queue size. Queued
+    neighbours that are still too far apart go on a heap keyed by the time
+    their bands will overlap; with ``timers`` set, a timer fires at the
+    earliest such time and ``on_pairs`` gets the pairs that widening made.
+    """
+
+    def __init__(
+        self,
+        band=DEFAULT_BAND,
+        widen_rate=DEFAULT_WIDEN_RATE,
+        max_band=DEFAULT_MAX_BAND,
+        timers=None,
+        on_pairs=None,
+        clock=time.monotonic,
+    ):
+        self.band = band
+        self.widen_rate = widen_rate
+        self.max_band = max_band
+        self.timers = timers
+        self.on_pairs = on_pairs
+        self.clock = clock
+        self._lock = threading.Lock()
+        # {bucket: SortedList of (rating, seq)}, {seq: Seek} and {key: Seek}
+        self._queues = {}
+        self._by_seq = {}
+        self._by_key = {}
+        self._counter = itertools.count()
+        # (time two queued seeks become compatible, seq, seq); entries for
+        # seeks that left the queue are dropped when they come up
+        self._heap = []
+        self._timer = None
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def band_of(self, seek, now=None):
+        """Rating difference ``seek`` accepts at ``now``"""
+        now = self.clock() if now is None else now
+        widened = self.band + self.widen_rate * max(0.0, now - seek.since)
+        return min(self.max_band, widened)
+
+    def seek(self, key, rating, bucket, data=None):
+        """Queue ``key`` for a game in ``bucket``, replacing an earlier seek
+
+        Returns ``(partner, seek)`` if a queued seek matches at once, with
+        both already out of the queue, or None once the seek is queued.
+        """
+        with self._lock:
+            now = self.clock()
+            self._cancel(key)
+            seek = Seek(key, rating, bucket, now, next(self._counter), data)
+            queue = self._queues.get(bucket)
+            if queue:
+                index = queue.bisect_left((rating, -1))
+                partner = None
+                for neighbour in queue[max(0, index - 1) : index + 1]:
+                    other = self._by_seq[neighbour[1]]
+                    difference = abs(other.rating - rating)
+                    # Waiting seeks have bands at least as wide as a new one
+                    if difference <= self.band and (
+                        partner is None
+                        or difference < abs(partner.rating - rating)
+                        or difference == abs(partner.rating - rating)
+                        and other.seq < partner.seq
+                    ):
+                        partner = other
+                if partner is not None:
+                    self._remove(partner)
+                    return partner, seek
+            self._insert(seek)
+        self._arm()
+        return None
+
+    def requeue(self, seek):
+        """Put back a ``seek`` whose match fell through, as it was
+
+        It keeps its arrival time, so its band stays as wide as waiting has
+        made it. Returns False, leaving the queue alone, if its key has
+        queued a new seek meanwhile.
+        """
+        with self._lock:
+            if seek.key in self._by_key:
+                return False
+            self._insert(seek)
+        self._arm()
+        return True
+
+    def cancel(self, key):
+        """Take ``key`` out of the queue; returns its Seek, or None"""
+        with self._lock:
+            return self._cancel(key)
+
+    def pop_due(self, now=None, limit=None):
+        """Pairs that widening bands have matched by ``now``, out of the queue
+
+        At most ``limit`` candidate pairs are looked at; ``next_due()`` says
+        whether more are due.
+        """
+        pairs = []
+        with self._lock:
+            now = self.clock() if now is None else now
+            heap = self._heap
+            while heap and heap[0][0] <= now and limit != 0:
+                if limit is not None:
+                    limit -= 1
+                _, first, second = heapq.heappop(heap)
+                a = self._by_seq.get(first)
+                b = self._by_seq.get(second)
+                if a is None or b is None:
+                    continue
+                self._remove(a)
+                self._remove(b)
+                pairs.append((a, b) if a.seq < b.seq else (b, a))
+        return pairs
+
+    def next_due(self):
+        """Time the next queued pair may match, or None"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def _insert(self, seek):
+        """Queue ``seek`` and note when it will pair with its neighbours"""
+        queue = self._queues.get(seek.bucket)
+        if queue is None:
+            queue = self._queues[seek.bucket] = SortedList()
+        entry = (seek.rating, seek.seq)
+        queue.add(entry)
+        self._by_seq[seek.seq] = seek
+        self._by_key[seek.key] = seek
+        index = queue.bisect_left(entry)
+        if index > 0:
+            self._link(self._by_seq[queue[index - 1][1]], seek)
+        if index + 1 < len(queue):
+            self._link(seek, self._by_seq[queue[index + 1][1]])
+
+    def _cancel(self, key):
+        seek = self._by_key.get(key)
+        if seek is not None:
+            self._remove(seek)
+        return seek
+
+    def _remove(self, seek):
+        """Take a queued ``seek`` out; its neighbours become candidates"""
+        queue = self._queues[seek.bucket]
+        index = queue.index((seek.rating, seek.seq))
+        del queue[index]
+        del self._by_seq[seek.seq]
+        del self._by_key[seek.key]
+        if not queue:
+            del self._queues[seek.bucket]
+        elif 0 < index < len(queue):
+            self._link(self._by_seq[queue[index - 1][1]], self._by_seq[queue[index][1]])
+
+    def _link(self, a, b):
+        """Note when queued seeks ``a`` and ``b`` will accept each other"""
+        difference = abs(a.rating - b.rating)
+        if difference > self.max_band:
+            return
+        # The seek that arrived last has the narrower band
+        since = max(a.since, b.since)
+        if difference > self.band:
+            if self.widen_rate <= 0:
+                return
+            since += (difference - self.band) / self.widen_rate
+        heapq.heappush(self._heap, (since, a.seq, b.seq))
+
+    def _arm(self):
+        """Have ``timers`` run ``_fire`` when the earliest pair comes due"""
+        if self.timers is None:
+            return
+        due = self.next_due()
+        if due is None:
+            return
+        timer = self._timer
+        if timer is not None and not timer.cancelled and timer.deadline <= due:
+            return
+        self.timers.cancel(timer)
+        self._timer = self.timers.schedule(due, self._fire)
+
+    def _fire(self):
+        pairs = self.pop_due(limit=SWEEP_BATCH)
+        self._arm()
+        if pairs and self.on_pairs is not None:
+            self.on_pairs(pairs)
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return tuple(
+        samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+        for q in (0.5, 0.99, 1.0)
+    )
+
+
+def _simulate(queued, seeks, seed=1):
+    """Latencies of seeks, cancels and widening sweeps against a full queue
+
+    ``queued`` seekers are queued with a zero initial band so that none of
+    them pair on arrival; then the band opens to DEFAULT_BAND and ``seeks``
+    more seekers arrive, mostly pairing at once, and some queued ones
+    cancel. Finally the clock moves on until widening has paired everyone
+    it can. Times are wall-clock seconds spent in the Matchmaker.
+    """
+    import random
+
+    rng = random.Random(seed)
+    now = [0.0]
+    matchmaker = Matchmaker(band=0.0, clock=lambda: now[0])
+    buckets = ["1+0", "3+0", "3+2", "5+0", "5+3", "10+0", "15+10", "30+0"]
+
+    def arrive(i):
+        rating = min(3000.0, max(400.0, rng.gauss(1500.0, 350.0)))
+        started = time.perf_counter()
+        paired = matchmaker.seek(f"s{i}", rating, rng.choice(buckets))
+        return time.perf_counter() - started, paired
+
+    fill = []
+    for i in range(queued):
+        now[0] += 0.0001
+        fill.append(arrive(i)[0])
+    size = len(matchmaker)
+
+    matchmaker.band = DEFAULT_BAND
+    latencies = []
+    paired = 0
+    for i in range(queued, queued + seeks):
+        now[0] += 0.0001
+        latency, pair = arrive(i)
+        latencies.append(latency)
+        paired += pair is not None
+
+    keys = rng.sample(list(matchmaker._by_key), min(seeks // 4, len(matchmaker)))
+    cancels = []
+    for key in keys:
+        started = time.perf_counter()
+        matchmaker.cancel(key)
+        cancels.append(time.perf_counter() - started)
+
+    sweeps = []
+    widened = 0
+    for _ in range(int(DEFAULT_MAX_BAND / DEFAULT_WIDEN_RATE) + 1):
+        now[0] += 1.0
+        while (matchmaker.next_due() or now[0] + 1) <= now[0]:
+            started = time.perf_counter()
+            widened += len(matchmaker.pop_due(limit=SWEEP_BATCH))
+            sweeps.append(time.perf_counter() - started)
+    return {
+        "queued": size,
+        "fill": _percentiles(fill),
+        "seek": _percentiles(latencies),
+        "paired_on_arrival": paired,
+        "cancel": _percentiles(cancels),
+        "sweep_max_ms": max(sweeps) * 1000,
+        "paired_by_widening": widened,
+        "left": len(matchmaker),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Matchmaking load simulator")
+    parser.add_argument("--queued", type=int, default=50000)
+    parser.add_argument("--seeks", type=int, default=20000)
+    args = parser.parse_args()
+    result = _simulate(args.queued, args.seeks)
+    print(f"Queued {result['queued']} seekers")
+    for name in ("fill", "seek", "cancel"):
+        p50, p99, worst = result[name]
+        print(f"{name}: p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {worst:.3f} ms")
+    print(f"{result['paired_on_arrival']} of {args.seeks} seeks paired on arrival")
+    print(
+        f"Widening paired {result['paired_by_widening']} pairs, "
+        f"longest sweep {result['sweep_max_ms']:.1f} ms; "
+        f"{result['left']} left"
+    )
@@ -0,0 +1,166 @@
+import threading
+import time
+from array import array
+
+import chess
+
+from clocks import GameClock
+from outcome import OutcomeTracker, position_key
+
+# Captured pieces are counted per capturing side, pawn through queen
+CAPTURABLE = (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)
+SIDES = ("white", "black")
+# Every game starts here, so new boards skip hashing it
+INITIAL_POSITION_KEY = position_key(chess.Board())
+
+
+def encode_move(move):
+    """Pack a move into 15 bits: from square, to square, promotion piece type"""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    """Inverse of ``encode_move``"""
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+class PlayerSession:
+    """A connected client: who it is, which game it is in and how it wants moves"""
+
+    __slots__ = ("username", "game_id", "protocol", "legal_moves", "lock")
+
+    def __init__(self, protocol):
+        self.username = None
+        self.game_id = None
+        self.protocol = protocol
+        # Whether to send legal-move hints when it is this client's turn
+        self.legal_moves = False
+        # Held while anything changes which game this client is in; taken
+        # before any game lock
+        self.lock = threading.Lock()
+
+
+class DisconnectedPlayer:
+    """A player who dropped out of a game and may still reconnect"""
+
+    __slots__ = ("username", "disconnected_at", "deadline", "expired", "timer")
+
+    def __init__(self, username, deadline):
+        self.username = username
+        self.disconnected_at = time.time()
+        # time.monotonic() at which the reconnect window closes
+        self.deadline = deadline
+        self.expired = False
+        self.timer = None
+
+
+class Game:
+    """State of one game between two players
+
+    Moves are kept as 2-byte codes and captures as per-piece counters; the
+    board keeps no move stack because repetition is tracked by the outcome
+    tracker. ``moves_history()`` and ``captured_pieces()`` rebuild the
+    lists sent to clients.
+    """
+
+    __slots__ = (
+        "game_id",
+        "board",
+        "outcome",
+        "players",
+        "usernames",
+        "current_player",
+        "moves",
+        "captured",
+        "start_time",
+        "last_activity",
+        "time_control",
+        "clock",
+        "flag_timer",
+        "expiry_timer",
+        "disconnected_players",
+        "state_snapshot",
+        "result",
+        "winner",
+        "archived",
+        "opening",
+        "bot",
+        "version",
+    )
+
+    def __init__(self, game_id, time_control, session_id, username):
+        self.game_id = game_id
+        self.players = [session_id, None]
+        self.usernames = [username, None]
+        self.time_control = time_control
+        self.last_activity = time.monotonic()
+        self.flag_timer = None
+        self.expiry_timer = None
+        self.disconnected_players = [None, None]
+        # Engine level when one side is played by the computer, else None
+        self.bot = None
+        # Bumped by stores that share games between processes
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        """Start over from the initial position with a fresh clock"""
+        self.board = chess.Board()
+        self.outcome = OutcomeTracker.restore(self.board, {INITIAL_POSITION_KEY: 1}, 1)
+        self.current_player = 0
+        self.moves = array("H")
+        self.captured = bytearray(2 * len(CAPTURABLE))
+        self.start_time = time.time()
+        self.clock = GameClock.from_time_control(self.time_control)
+        self.state_snapshot = None
+        # How the game was decided ("checkmate", "resignation", ...) or None
+        self.result = None
+        # Index of the player who won, None for a draw or an unfinished game
+        self.winner = None
+        # Whether the finished game was written to the archive
+        self.archived = False
+        # (eco, name) of the last named opening position reached, or None
+        self.opening = None
+
+    def add_capture(self, side, piece_type):
+        """Count a ``piece_type`` captured by ``side`` (0 white, 1 black)"""
+        self.captured[side * len(CAPTURABLE) + piece_type - 1] += 1
+
+    def push(self, move):
+        """Play ``move`` and return the resulting Outcome"""
+        outcome = self.outcome.push(self.board, move)
+        self.board.clear_stack()
+        self.moves.append(encode_move(move))
+        self.current_player = 1 - self.current_player
+        return outcome
+
+    def apply(self, move, outcome):
+        """Play ``move`` whose Outcome a game shard already worked out
+
+        Skips legal-move generation, so the shard stays the authority on
+        this game's outcomes.
+        """
+        self.board.push(move)
+        self.board.clear_stack()
+        self.outcome.record(outcome)
+        self.moves.append(encode_move(move))
+        self.current_player = 1 - self.current_player
+
+    def moves_history(self):
+        """Moves played so far in UCI notation"""
+        return [decode_move(code).uci() for code in self.moves]
+
+    def captured_pieces(self):
+        """Captured pieces grouped by capturing side, as sent to clients"""
+        pieces = {}
+        for side, name in enumerate(SIDES):
+            victim = SIDES[1 - side]
+            pieces[name] = [
+                {
+                    "type": chess.Piece(piece_type, side == 1).symbol(),
+                    "color": victim,
+                }
+                for i, piece_type in enumerate(CAPTURABLE)
+                for _ in range(self.captured[side * len(CAPTURABLE) + i])
+            ]
+        return pieces
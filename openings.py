@@ -0,0 +1,66 @@
+import csv
+import random
+
+import chess
+import chess.polyglot
+
+
+def open_book(path):
+    """Memory-map the Polyglot book at ``path``
+
+    Nothing is parsed up front: each lookup hashes the position and
+    binary-searches the book's sorted 16-byte entries in the mapping.
+    Every process that opens the same file reads the same page-cache copy.
+    """
+    return chess.polyglot.MemoryMappedReader(path)
+
+
+def book_move(book, board, rng=random):
+    """A book move for ``board`` picked by entry weight, or None"""
+    try:
+        return book.weighted_choice(board, random=rng).move
+    except IndexError:
+        return None
+
+
+class OpeningNames:
+    """ECO codes and names of known opening positions
+
+    Loaded from a tab-separated file with ``eco``, ``name`` and the line
+    itself as ``uci`` or ``pgn`` (the layout of the lichess chess-openings
+    files). Positions are matched by EPD, so transpositions get the same
+    name.
+    """
+
+    def __init__(self, path):
+        self.positions = {}
+        # No named line is longer than this, so later moves skip the lookup
+        self.max_ply = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                epd, ply = _line_position(row)
+                self.positions[epd] = (row["eco"], row["name"])
+                self.max_ply = max(self.max_ply, ply)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def lookup(self, board):
+        """``(eco, name)`` of ``board``'s position, or None"""
+        if board.ply() > self.max_ply:
+            return None
+        return self.positions.get(board.epd())
+
+
+def _line_position(row):
+    """EPD and ply count of the position an opening line ends in"""
+    board = chess.Board()
+    if row.get("uci"):
+        for uci in row["uci"].split():
+            board.push_uci(uci)
+    else:
+        for token in row["pgn"].split():
+            # Skip move numbers like "1." and "12..."
+            if not token.rstrip(".").isdigit():
+                board.push_san(token)
+    return board.epd(), board.ply()
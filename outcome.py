@@ -0,0 +1,225 @@
+from collections import namedtuple
+
+import chess
+import chess.polyglot
+
+_hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+
+def position_key(board):
+    """Zobrist key that treats positions as equal exactly when ``is_repetition`` does
+
+    Polyglot hashes the en passant file whenever a pawn could capture; python-chess
+    only distinguishes positions whose en passant capture is actually legal.
+    """
+    key = _hasher(board)
+    if board.ep_square is not None and not board.has_legal_en_passant():
+        key ^= _hasher.hash_ep_square(board)
+    return key
+
+
+def _piece_masks(board):
+    # In Polyglot piece order: black pawn, white pawn, black knight, ...
+    black, white = board.occupied_co
+    return [
+        mask & side
+        for mask in (
+            board.pawns,
+            board.knights,
+            board.bishops,
+            board.rooks,
+            board.queens,
+            board.kings,
+        )
+        for side in (black, white)
+    ]
+
+
+def position_keys(moves, board=None):
+    """Yield ``position_key`` of ``board`` and of each position ``moves`` lead to
+
+    The moves are pushed onto ``board`` (the starting position by default).
+    Only the squares a move changed are rehashed, which is several times
+    cheaper than hashing every position from scratch.
+    """
+    if board is None:
+        board = chess.Board()
+    array = _hasher.array
+    pieces = _hasher.hash_board(board)
+    masks = _piece_masks(board)
+    rights = board.castling_rights
+    castling = _hasher.hash_castling(board)
+    yield position_key(board)
+    for move in moves:
+        board.push(move)
+        after = _piece_masks(board)
+        for index, (old, new) in enumerate(zip(masks, after)):
+            changed = old ^ new
+            while changed:
+                square = changed.bit_length() - 1
+                pieces ^= array[64 * index + square]
+                changed ^= 1 << square
+        masks = after
+        if board.castling_rights != rights:
+            rights = board.castling_rights
+            castling = _hasher.hash_castling(board)
+        key = pieces ^ castling ^ _hasher.hash_turn(board)
+        ep_square = board.ep_square
+        # Most double pushes leave no pawn beside them to capture
+        if (
+            ep_square is not None
+            and board.pawns
+            & board.occupied_co[board.turn]
+            & chess.BB_PAWN_ATTACKS[not board.turn][ep_square]
+            and board.has_legal_en_passant()
+        ):
+            key ^= _hasher.hash_ep_square(board)
+        yield key
+
+
+class Outcome(
+    namedtuple(
+        "Outcome",
+        [
+            "is_check",
+            "is_checkmate",
+            "is_stalemate",
+            "is_insufficient_material",
+            "is_repetition",
+            "is_fivefold_repetition",
+            "is_seventyfive_moves",
+            "is_fifty_moves",
+        ],
+    )
+):
+    """Game-end flags for one position, as emitted in move_made/board_state"""
+
+    __slots__ = ()
+
+    @property
+    def is_draw(self):
+        return (
+            self.is_stalemate
+            or self.is_insufficient_material
+            or self.is_fivefold_repetition
+            or self.is_seventyfive_moves
+            or self.is_repetition
+            or self.is_fifty_moves
+        )
+
+    @property
+    def game_end_reason(self):
+        if self.is_checkmate:
+            return "checkmate"
+        if self.is_stalemate:
+            return "stalemate"
+        if self.is_insufficient_material:
+            return "insufficient_material"
+        if self.is_repetition:
+            return "threefold_repetition"
+        if self.is_fivefold_repetition:
+            return "fivefold_repetition"
+        if self.is_seventyfive_moves:
+            return "seventyfive_moves"
+        if self.is_fifty_moves:
+            return "fifty_moves"
+        return None
+
+
+class OutcomeTracker:
+    """Incremental game-end detection for one game
+
+    Keeps a Zobrist-keyed count of positions since the last irreversible move
+    and the insufficient-material verdict, so each ply generates legal moves
+    once and never replays the move stack. Results match the individual
+    ``chess.Board.is_*`` predicates. The current position's full legal move
+    set is built only when first asked for and kept until the next push.
+    """
+
+    __slots__ = ("repetitions", "insufficient_material", "current", "legal")
+
+    def __init__(self, board):
+        self.repetitions = {}
+        self.legal = None
+        replay = board.root()
+        self.repetitions[position_key(replay)] = 1
+        for move in board.move_stack:
+            self._count(replay, move)
+        self.insufficient_material = board.is_insufficient_material()
+        self.current = self._evaluate(board, self.repetitions[position_key(board)])
+
+    @classmethod
+    def restore(cls, board, repetitions, count=None):
+        """Tracker for ``board`` from the position counts saved with it
+
+        ``repetitions`` is a saved tracker's ``repetitions`` and ``count``
+        how often ``board``'s position occurred, looked up if not given;
+        the moves that led to ``board`` are not needed.
+        """
+        tracker = cls.__new__(cls)
+        tracker.repetitions = repetitions
+        tracker.legal = None
+        tracker.insufficient_material = board.is_insufficient_material()
+        if count is None:
+            count = repetitions.get(position_key(board), 1)
+        tracker.current = tracker._evaluate(board, count)
+        return tracker
+
+    def _count(self, board, move):
+        """Push ``move`` and return how often the new position has occurred"""
+        if board.is_irreversible(move):
+            self.repetitions.clear()
+        board.push(move)
+        key = position_key(board)
+        count = self.repetitions.get(key, 0) + 1
+        self.repetitions[key] = count
+        return count
+
+    def _evaluate(self, board, count):
+        has_legal_moves = any(board.generate_legal_moves())
+        is_check = board.is_check()
+        halfmoves = board.halfmove_clock
+        return Outcome(
+            is_check=is_check,
+            is_checkmate=is_check and not has_legal_moves,
+            is_stalemate=not is_check and not has_legal_moves,
+            is_insufficient_material=self.insufficient_material,
+            is_repetition=count >= 3,
+            is_fivefold_repetition=count >= 5,
+            is_seventyfive_moves=halfmoves >= 150 and has_legal_moves,
+            is_fifty_moves=halfmoves >= 100 and has_legal_moves,
+        )
+
+    def push(self, board, move):
+        """Push ``move`` onto ``board`` and return the resulting Outcome"""
+        # Material only shrinks on captures and changes shape on promotions
+        material_changed = move.promotion is not None or board.is_capture(move)
+        count = self._count(board, move)
+        if material_changed:
+            self.insufficient_material = board.is_insufficient_material()
+        self.legal = None
+        self.current = self._evaluate(board, count)
+        return self.current
+
+    def record(self, outcome):
+        """Take ``outcome`` for a position that was pushed without this tracker
+
+        The repetition table is not updated, so whoever computed ``outcome``
+        stays the authority on later positions.
+        """
+        self.legal = None
+        self.current = outcome
+
+    def legal_moves(self, board):
+        """Legal moves of the current position, generated at most once per ply"""
+        if self.legal is None:
+            self.legal = frozenset(board.generate_legal_moves())
+        return self.legal
+
+    def is_legal(self, board, move):
+        """``move in board.legal_moves``, from the ply's move set once it exists"""
+        # Building the set costs several single-move checks, so it is left
+        # to callers that need every move
+        if self.legal is None:
+            return board.is_legal(move)
+        return move in self.legal
@@ -0,0 +1,375 @@
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import chess
+
+from models import decode_move
+from outcome import position_key, position_keys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    location INTEGER PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    white TEXT,
+    black TEXT,
+    result TEXT,
+    winner INTEGER,
+    time_control TEXT,
+    eco TEXT,
+    opening TEXT,
+    bot INTEGER,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    day INTEGER NOT NULL,
+    plies INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_games_result ON games (result, location);
+CREATE INDEX IF NOT EXISTS idx_games_day ON games (day, location);
+CREATE INDEX IF NOT EXISTS idx_games_eco ON games (eco, location);
+
+CREATE TABLE IF NOT EXISTS game_players (
+    name TEXT NOT NULL,
+    location INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    PRIMARY KEY (name, location)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS game_positions (
+    position INTEGER NOT NULL,
+    location INTEGER NOT NULL,
+    PRIMARY KEY (position, location)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS index_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+SQL_INSERT_GAME = (
+    "INSERT OR IGNORE INTO games (location, game_id, white, black, result, winner, "
+    "time_control, eco, opening, bot, start_time, end_time, day, plies) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_INSERT_PLAYER = (
+    "INSERT OR IGNORE INTO game_players (name, location, side) VALUES (?, ?, ?)"
+)
+SQL_INSERT_POSITION = (
+    "INSERT OR IGNORE INTO game_positions (position, location) VALUES (?, ?)"
+)
+SQL_NEXT_LOCATION = "SELECT value FROM index_state WHERE name = 'next_location'"
+SQL_SET_NEXT_LOCATION = (
+    "INSERT INTO index_state (name, value) VALUES ('next_location', ?) "
+    "ON CONFLICT (name) DO UPDATE SET value = excluded.value"
+)
+SQL_COUNT_GAMES = "SELECT COUNT(*) FROM games"
+GAME_COLUMNS = (
+    "location",
+    "game_id",
+    "white",
+    "black",
+    "result",
+    "winner",
+    "time_control",
+    "eco",
+    "opening",
+    "bot",
+    "start_time",
+    "end_time",
+    "plies",
+)
+
+OUTCOMES = {
+    "win": "g.winner = p.side",
+    "loss": "g.winner = 1 - p.side",
+    "draw": "g.winner IS NULL",
+}
+EPOCH = date(1970, 1, 1)
+DEFAULT_INDEX_INTERVAL = 2.0
+# Games written per transaction while catching up
+INDEX_BATCH = 200
+
+
+def day_number(value):
+    """Days since 1970-01-01 of an ISO date string"""
+    return (date.fromisoformat(value) - EPOCH).days
+
+
+def _signed(key):
+    # SQLite integers are signed 64-bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def signed_position(board):
+    """``position_key(board)`` as the integer the position index stores"""
+    return _signed(position_key(board))
+
+
+def _positions(moves):
+    """Index keys of every position an archived game reached"""
+    return {_signed(key) for key in position_keys(map(decode_move, moves))}
+
+
+class GameIndex:
+    """Search indexes over the game archive, kept in an SQLite database
+
+    Each archived game gets a row with its players, result, winner and end
+    date, and one row per position it reached keyed by the position's
+    Zobrist hash, so searches never read the archive files. A background
+    thread follows the archive every ``interval`` seconds, or sooner after
+    ``notify()``. Inserts are idempotent, so workers sharing an archive can
+    share one database too.
+    """
+
+    def __init__(self, path, archive, interval=DEFAULT_INDEX_INTERVAL):
+        self.path = path
+        self.archive = archive
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=64,
+            timeout=30,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="game-index", daemon=True
+            )
+            self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(SQL_COUNT_GAMES).fetchone()[0]
+
+    def notify(self):
+        """Index newly archived games now instead of at the next interval"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                self.catch_up()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                print(f"Failed to index archived games: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def catch_up(self):
+        """Index every archived game not indexed yet; returns how many"""
+        with self._lock:
+            row = self._conn.execute(SQL_NEXT_LOCATION).fetchone()
+        start = row[0] if row else 0
+        batch = []
+        count = 0
+        for archived in self.archive.scan(start):
+            if self._closed:
+                break
+            batch.append((archived, _positions(archived.moves)))
+            if len(batch) == INDEX_BATCH:
+                count += self._write(batch)
+                batch = []
+            # Hashing every position is CPU-bound: let other threads (or
+            # greenlets) run between games
+            time.sleep(0)
+        if batch:
+            count += self._write(batch)
+        return count
+
+    def _write(self, batch):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for archived, positions in batch:
+                where = archived.location
+                self._conn.execute(
+                    SQL_INSERT_GAME,
+                    (
+                        where,
+                        archived.game_id,
+                        archived.white,
+                        archived.black,
+                        archived.result,
+                        archived.winner,
+                        archived.time_control,
+                        archived.eco,
+                        archived.opening,
+                        archived.bot,
+                        archived.start_time,
+                        archived.end_time,
+                        int(archived.end_time // 86400),
+                        len(archived.moves),
+                    ),
+                )
+                for side, name in enumerate((archived.white, archived.black)):
+                    if name:
+                        self._conn.execute(SQL_INSERT_PLAYER, (name, where, side))
+                self._conn.executemany(
+                    SQL_INSERT_POSITION, ((key, where) for key in positions)
+                )
+            self._conn.execute(SQL_SET_NEXT_LOCATION, (batch[-1][0].location + 1,))
+        return len(batch)
+
+    def search(
+        self,
+        player=None,
+        outcome=None,
+        result=None,
+        eco=None,
+        since=None,
+        until=None,
+        position=None,
+        cursor=None,
+        limit=20,
+    ):
+        """Archived games matching every given filter, newest first
+
+        ``outcome`` ("win", "loss" or "draw") is ``player``'s result;
+        ``eco`` matches ECO codes by prefix ("B" or "B90"); ``since`` and
+        ``until`` are day numbers of the end date, inclusive; ``position``
+        is a ``signed_position`` key. Returns the games and the cursor for
+        the next page, or None after the last one.
+        """
+        if outcome is not None and (player is None or outcome not in OUTCOMES):
+            raise ValueError("outcome needs a player and one of win, loss or draw")
+        joins, where, params = [], [], []
+        # Drive the query from the most selective index, so a page costs
+        # one range scan whatever the archive's size
+        order = "g.location"
+        if position is not None:
+            joins.append("JOIN game_positions s ON s.location = g.location")
+            where.append("s.position = ?")
+            params.append(position)
+            order = "s.location"
+        if player is not None:
+            joins.append("JOIN game_players p ON p.location = g.location")
+            where.append("p.name = ?")
+            params.append(player)
+            if position is None:
+                order = "p.location"
+            if outcome is not None:
+                where.append(OUTCOMES[outcome])
+        if result is not None:
+            where.append("g.result = ?")
+            params.append(result)
+        if eco is not None:
+            # ECO codes are ASCII, so every code with the prefix sorts
+            # before the prefix followed by DEL
+            where.append("g.eco >= ? AND g.eco < ?")
+            params.extend((eco, eco + "\x7f"))
+        if since is not None:
+            where.append("g.day >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("g.day <= ?")
+            params.append(until)
+        if cursor is not None:
+            where.append(f"{order} < ?")
+            params.append(cursor)
+        sql = "SELECT " + ", ".join(f"g.{column}" for column in GAME_COLUMNS)
+        sql += " FROM games g " + " ".join(joins)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        games = [dict(zip(GAME_COLUMNS, row)) for row in rows[:limit]]
+        next_cursor = games[-1]["location"] if len(rows) > limit else None
+        return games, next_cursor
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        with self._lock:
+            self._conn.close()
+
+
+def _bench(games, seed=1):
+    """Seconds to index ``games`` random archived games and milliseconds per
+    search page, for a few kinds of query"""
+    import os
+    import random
+    import shutil
+    import tempfile
+
+    from archive import GameArchive
+    from models import Game
+
+    rng = random.Random(seed)
+    names = [f"player{i}" for i in range(max(games // 20, 2))]
+    results = ("checkmate", "resignation", "timeout", "agreed_draw", "stalemate")
+    openings = [
+        (f"{volume}{i:02d}", "Opening") for volume in "ABCDE" for i in range(100)
+    ]
+    templates = []
+    for i in range(64):
+        game = Game(f"T{i}", "5+3", None, None)
+        plies = rng.randrange(20, 100)
+        while len(game.moves) < plies and not game.board.is_game_over():
+            game.push(rng.choice(list(game.board.legal_moves)))
+        templates.append(game)
+
+    directory = tempfile.mkdtemp(prefix="search-bench-")
+    try:
+        archive = GameArchive(os.path.join(directory, "archive"))
+        for i in range(games):
+            game = templates[i % len(templates)]
+            game.game_id = f"G{i:07d}"
+            game.usernames = rng.sample(names, 2)
+            game.result = rng.choice(results)
+            game.winner = None if game.result.endswith("draw") else rng.choice((0, 1))
+            game.start_time = time.time() - rng.randrange(60 * 86400)
+            game.opening = rng.choice(openings)
+            archive.append(game)
+        index = GameIndex(os.path.join(directory, "index.db"), archive, interval=0)
+        started = time.perf_counter()
+        assert index.catch_up() == games
+        indexing = time.perf_counter() - started
+
+        week = (date.today() - EPOCH).days - 7
+        opening = chess.Board()
+        for uci in ("e2e4", "e7e5"):
+            opening.push_uci(uci)
+        queries = {
+            "player": dict(player=names[0]),
+            "player lost on time this week": dict(
+                player=names[0], outcome="loss", result="timeout", since=week
+            ),
+            "result": dict(result="stalemate"),
+            "opening": dict(eco="C2"),
+            "position": dict(position=signed_position(opening)),
+        }
+        timings = {}
+        for name, query in queries.items():
+            started = time.perf_counter()
+            for _ in range(50):
+                index.search(limit=20, **query)
+            timings[name] = (time.perf_counter() - started) / 50 * 1000
+        index.close()
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+    return indexing, timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark archive search")
+    parser.add_argument("--games", type=int, default=20000)
+    args = parser.parse_args()
+    indexing, timings = _bench(args.games)
+    print(f"Indexed {args.games} games in {indexing:.2f}s")
+    for name, millis in timings.items():
+        print(f"{name}: {millis:.2f} ms per page")
@@ -0,0 +1,191 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+
+# asyncio is not offered: Flask-SocketIO serves a WSGI app, so its
+# cooperative modes are eventlet and gevent
+ASYNC_MODES = ("eventlet", "gevent", "threading")
+LISTEN_BACKLOG = 2048
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the chess server in production")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes sharing the port (needs GAME_STORE=redis, "
+        "SOCKETIO_MESSAGE_QUEUE and LEADERBOARD_BACKEND=sqlite)",
+    )
+    parser.add_argument("--async-mode", choices=ASYNC_MODES, default="gevent")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="processes per worker that validate moves, each owning a share "
+        "of the games (0 = validate in the worker)",
+    )
+    parser.add_argument(
+        "--engine-workers",
+        type=int,
+        default=1,
+        help="processes per worker that search moves for computer opponents "
+        "(0 = no bot games)",
+    )
+    parser.add_argument(
+        "--ping-interval",
+        type=float,
+        default=10,
+        help="seconds between keepalive pings",
+    )
+    parser.add_argument(
+        "--ping-timeout",
+        type=float,
+        default=10,
+        help="seconds without a pong before a client counts as disconnected",
+    )
+    parser.add_argument(
+        "--allow-polling",
+        action="store_true",
+        help="also offer HTTP long-polling (single worker only)",
+    )
+    return parser.parse_args(argv)
+
+
+def check_config(args):
+    """Return an error message if the settings cannot work together, else None"""
+    if args.workers < 1:
+        return "--workers must be at least 1"
+    if args.shards < 0:
+        return "--shards must not be negative"
+    if args.engine_workers < 0:
+        return "--engine-workers must not be negative"
+    if os.getenv("GAME_JOURNAL_DIR") and os.getenv("GAME_STORE", "memory") != "memory":
+        return "GAME_JOURNAL_DIR needs GAME_STORE=memory; Redis keeps games itself"
+    if args.workers == 1:
+        return None
+    if args.async_mode == "threading":
+        return "--workers > 1 needs --async-mode eventlet or gevent"
+    if args.allow_polling:
+        return (
+            "long-polling needs sticky sessions; use one worker or drop --allow-polling"
+        )
+    if os.getenv("GAME_STORE", "memory") != "redis":
+        return "--workers > 1 needs GAME_STORE=redis so workers share games"
+    if not os.getenv("SOCKETIO_MESSAGE_QUEUE"):
+        return (
+            "--workers > 1 needs SOCKETIO_MESSAGE_QUEUE to relay emits between workers"
+        )
+    if os.getenv("LEADERBOARD_BACKEND", "json") != "sqlite":
+        return "--workers > 1 needs LEADERBOARD_BACKEND=sqlite"
+    return None
+
+
+def configure(args):
+    """Hand the socket settings to app.py, which reads them at import"""
+    os.environ["SOCKETIO_ASYNC_MODE"] = args.async_mode
+    os.environ["SOCKETIO_TRANSPORTS"] = (
+        "polling,websocket" if args.allow_polling else "websocket"
+    )
+    os.environ["SOCKETIO_PING_INTERVAL"] = str(args.ping_interval)
+    os.environ["SOCKETIO_PING_TIMEOUT"] = str(args.ping_timeout)
+    os.environ["GAME_SHARDS"] = str(args.shards)
+    os.environ["ENGINE_WORKERS"] = str(args.engine_workers)
+
+
+def listen(host, port, reuse_port):
+    """Open the listening socket, shared between workers with SO_REUSEPORT"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    return sock
+
+
+def serve(args, reuse_port=False):
+    """Run one server process until it is told to stop"""
+    # Patch before app.py is imported so its locks, timers and sockets
+    # are cooperative
+    if args.async_mode == "eventlet":
+        import eventlet
+
+        eventlet.monkey_patch()
+    elif args.async_mode == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+
+    from app import app, socketio
+
+    # Turn SIGTERM into a normal exit so atexit flushes the leaderboard
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(
+        f"Chess server (pid {os.getpid()}, {args.async_mode}) "
+        f"listening on {args.host}:{args.port}"
+    )
+
+    if args.async_mode == "threading":
+        socketio.run(app, host=args.host, port=args.port, allow_unsafe_werkzeug=True)
+    elif args.async_mode == "eventlet":
+        import eventlet.wsgi
+
+        sock = listen(args.host, args.port, reuse_port)
+        eventlet.wsgi.server(sock, app, log_output=False)
+    else:
+        from gevent import pywsgi
+
+        try:
+            from geventwebsocket.handler import WebSocketHandler as handler_class
+        except ImportError:
+            # Without gevent-websocket engine.io upgrades through simple-websocket
+            handler_class = pywsgi.WSGIHandler
+        sock = listen(args.host, args.port, reuse_port)
+        server = pywsgi.WSGIServer(sock, app, handler_class=handler_class, log=None)
+        server.serve_forever()
+
+
+def run_workers(args):
+    """Fork ``args.workers`` servers on one port and wait for them"""
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            # Exit normally (never back into this loop) so atexit handlers run
+            serve(args, reuse_port=True)
+            sys.exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    error = check_config(args)
+    if error:
+        print(f"serve.py: {error}", file=sys.stderr)
+        sys.exit(2)
+    configure(args)
+    if args.workers == 1:
+        serve(args)
+    else:
+        run_workers(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import functools
+import itertools
+import threading
+import zlib
+from array import array
+from collections import namedtuple
+
+import chess
+
+from clocks import DEFAULT_TIME_CONTROL
+from models import Game, decode_move, encode_move
+from outcome import Outcome
+from workers import WorkerPool
+
+# Boards a shard keeps; the least recently used are dropped past this and
+# rebuilt from the move list if their game comes back
+SHARD_GAME_LIMIT = 10000
+
+MoveDetails = namedtuple(
+    "MoveDetails", ["is_capture", "is_en_passant", "is_castle", "captured_piece"]
+)
+
+
+def illegal_move_error(board, legal_moves, move):
+    """Return ``(code, message)`` explaining why ``move`` is not in ``legal_moves``"""
+    # A pawn move to the last rank is legal only with a promotion piece
+    if (
+        move.promotion is None
+        and chess.Move(move.from_square, move.to_square, chess.QUEEN) in legal_moves
+    ):
+        return (
+            "PROMOTION_REQUIRED",
+            "Pawn promotion requires specifying piece (e.g., e7e8q)",
+        )
+
+    # Check if move is pseudo-legal (exists but not legal due to leaving king in check)
+    if board.is_pseudo_legal(move):
+        return "KING_IN_CHECK", "Illegal move: would leave king in check"
+    return "ILLEGAL_MOVE", "Illegal move for this piece"
+
+
+def move_details(board, move):
+    """Describe a legal ``move`` before it is pushed onto ``board``"""
+    is_capture = board.is_capture(move)
+    # Check for en passant: it's a capture but the target square doesn't have a piece
+    is_en_passant = is_capture and board.piece_at(move.to_square) is None
+
+    # Track captured piece
+    captured_piece = None
+    if is_en_passant:
+        # En passant: captured pawn is one rank behind the target square
+        # White moves up the board (increasing rank), so captured pawn is below target
+        # Black moves down (decreasing rank), so captured pawn is above target
+        captured_square = (
+            move.to_square - 8 if board.turn == chess.WHITE else move.to_square + 8
+        )
+        captured_piece = board.piece_at(captured_square)
+    elif is_capture:
+        captured_piece = board.piece_at(move.to_square)
+
+    return MoveDetails(
+        is_capture, is_en_passant, board.is_castling(move), captured_piece
+    )
+
+
+def position_state(board, outcome):
+    """The position part of a board_state payload"""
+    # Get en passant target
+    ep_square = board.ep_square
+    return {
+        "board_fen": board.fen(),
+        "is_check": outcome.is_check,
+        "is_checkmate": outcome.is_checkmate,
+        "is_stalemate": outcome.is_stalemate,
+        "is_insufficient_material": outcome.is_insufficient_material,
+        "is_repetition": outcome.is_repetition,
+        "is_fivefold_repetition": outcome.is_fivefold_repetition,
+        "is_seventyfive_moves": outcome.is_seventyfive_moves,
+        "is_fifty_moves": outcome.is_fifty_moves,
+        "is_draw": outcome.is_draw,
+        # Get castling rights
+        "castling": {
+            "K": board.has_kingside_castling_rights(chess.WHITE),
+            "Q": board.has_queenside_castling_rights(chess.WHITE),
+            "k": board.has_kingside_castling_rights(chess.BLACK),
+            "q": board.has_queenside_castling_rights(chess.BLACK),
+        },
+        "en_passant": chess.square_name(ep_square) if ep_square else None,
+        # Half move clock (for 50-move rule)
+        "half_moves": board.halfmove_clock,
+        "full_moves": board.fullmove_number,
+    }
+
+
+def legal_move_map(legal_moves):
+    """Compact ``{from: [to, ...]}`` hints for a position's legal moves"""
+    targets = {}
+    for move in legal_moves:
+        targets.setdefault(move.from_square, set()).add(move.to_square)
+    return {
+        chess.SQUARE_NAMES[source]: [chess.SQUARE_NAMES[t] for t in sorted(squares)]
+        for source, squares in sorted(targets.items())
+    }
+
+
+def shard_index(game_id, count):
+    """Shard owning ``game_id``; stable across processes, unlike ``hash()``"""
+    return zlib.crc32(game_id.encode("utf-8")) % count
+
+
+class ShardPool:
+    """Move validation for games spread over ``count`` worker processes
+
+    Each game is owned by one shard, picked from its room code, which keeps
+    the board and outcome tracker and does the legal-move work off the
+    server's GIL. A request carries only the moves played since the shard
+    last saw the game, with the ply they start at and a token naming the
+    move list. A shard whose copy does not match (a reset, a restore from
+    the journal or a shard restart) answers ``resync`` and is sent the
+    whole list once.
+
+    Sharding is opt-in (``GAME_SHARDS``): each move costs a round trip to
+    another process, which only pays off with spare cores.
+    """
+
+    def __init__(self, count):
+        self._workers = WorkerPool(count, _shard_handler, "game-shard")
+        # {game_id: (move list, token, plies of it the shard holds, code of
+        # a move the shard played past them or None)}. The list is kept so
+        # a reset's new list is told apart by identity; lists only grow
+        self._sent = {}
+        self._tokens = itertools.count(1)
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _call(self, game, kind, *args):
+        """Send ``kind`` for ``game`` to its shard with the moves it lacks
+
+        Returns the shard's reply.
+        """
+        game_id, moves = game.game_id, game.moves
+        index = shard_index(game_id, len(self._workers))
+        sent = self._sent.get(game_id)
+        if sent is None or sent[0] is not moves:
+            token, base = next(self._tokens), 0
+        else:
+            _, token, base, played = sent
+            if played is not None:
+                # The shard's extra move counts only if it is the one applied
+                if base < len(moves) and moves[base] == played:
+                    base += 1
+                else:
+                    token, base = next(self._tokens), 0
+        reply = self._workers.call(
+            index, (kind, game_id, token, base, moves[base:].tobytes()) + args
+        )
+        if reply[0] == "resync":
+            reply = self._workers.call(
+                index, (kind, game_id, token, 0, moves.tobytes()) + args
+            )
+        self._sent[game_id] = (moves, token, len(moves), None)
+        return reply
+
+    def play(self, game, move, hints=False):
+        """Validate and play ``move`` on the shard's copy of ``game``
+
+        Returns ``(error, details, outcome, legal_moves)``: ``error`` is
+        ``(code, message)`` for an illegal move, else None with the
+        MoveDetails, Outcome and, if ``hints``, the next position's
+        ``legal_move_map``.
+        """
+        reply = self._call(game, "move", move.uci(), hints)
+        if reply[0] == "illegal":
+            return reply[1:], None, None, None
+        # The shard is a ply ahead until the caller applies the move
+        moves, token, plies, _ = self._sent[game.game_id]
+        self._sent[game.game_id] = (moves, token, plies, encode_move(move))
+        return None, MoveDetails(*reply[1]), Outcome(*reply[2]), reply[3]
+
+    def position(self, game):
+        """``position_state`` of ``game``, computed by its shard"""
+        return self._call(game, "state")[1]
+
+    def legal_moves(self, game):
+        """``legal_move_map`` of ``game``'s position, computed by its shard"""
+        return self._call(game, "hints")[1]
+
+    def drop(self, game_id):
+        """Let the owning shard forget ``game_id``"""
+        self._sent.pop(game_id, None)
+        self._workers.call(shard_index(game_id, len(self._workers)), ("drop", game_id))
+
+    def close(self):
+        self._workers.close()
+
+
+def _sync(games, game_id, token, base, packed):
+    """Return the shard's game ``game_id`` with the moves ``packed`` played
+    from ply ``base`` of move list ``token``, or None if its copy differs"""
+    entry = games.pop(game_id, None)
+    if entry is not None and entry[0] == token and len(entry[1].moves) == base:
+        game = entry[1]
+    elif base == 0:
+        game = Game(game_id, DEFAULT_TIME_CONTROL, None, None)
+    else:
+        return None
+    for code in array("H", packed):
+        game.push(decode_move(code))
+    # Reinserting keeps the dict in least-recently-used order
+    games[game_id] = (token, game)
+    if len(games) > SHARD_GAME_LIMIT:
+        del games[next(iter(games))]
+    return game
+
+
+def _handle(games, message):
+    kind, game_id = message[0], message[1]
+    if kind == "drop":
+        games.pop(game_id, None)
+        return ("ok",)
+    game = _sync(games, game_id, *message[2:5])
+    if game is None:
+        return ("resync",)
+    board, tracker = game.board, game.outcome
+    if kind == "state":
+        return ("ok", position_state(board, tracker.current))
+    if kind == "hints":
+        return ("ok", legal_move_map(tracker.legal_moves(board)))
+
+    move = chess.Move.from_uci(message[5])
+    if not tracker.is_legal(board, move):
+        return ("illegal",) + illegal_move_error(
+            board, tracker.legal_moves(board), move
+        )
+    details = move_details(board, move)
+    outcome = game.push(move)
+    hints = legal_move_map(tracker.legal_moves(board)) if message[6] else None
+    return ("ok", tuple(details), tuple(outcome), hints)
+
+
+def _shard_handler():
+    """Request handler for one shard process, owning its games"""
+    return functools.partial(_handle, {})
+
+
+def _bench(shards, games, threads, seed=1):
+    """Moves per second replaying random games from ``threads`` threads"""
+    import random
+    import time
+
+    rng = random.Random(seed)
+    scripts = []
+    for n in range(games):
+        board = chess.Board()
+        moves = []
+        while len(moves) < 80 and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            moves.append(move)
+            board.push(move)
+        scripts.append((f"B{n:05d}", moves))
+
+    pool = ShardPool(shards) if shards else None
+
+    def play(batch):
+        for game_id, moves in batch:
+            game = Game(game_id, DEFAULT_TIME_CONTROL, None, None)
+            for move in moves:
+                if pool is not None:
+                    error, details, outcome, hints = pool.play(game, move)
+                    game.apply(move, outcome)
+                else:
+                    assert move in game.board.legal_moves
+                    move_details(game.board, move)
+                    game.push(move)
+
+    workers = [
+        threading.Thread(target=play, args=(scripts[i::threads],))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    if pool is not None:
+        pool.close()
+    return sum(len(moves) for _, moves in scripts) / elapsed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark sharded move validation")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--games", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+    for count in args.shards:
+        rate = _bench(count, args.games, args.threads)
+        label = f"{count} shards" if count else "in-process"
+        print(f"{label:>12}: {rate:,.0f} moves/s")
@@ -0,0 +1,154 @@
+import threading
+import time
+
+# Packets queued on a spectator's connection past which it stops getting
+# updates until it has caught up
+DEFAULT_MAX_BACKLOG = 32
+
+
+def spectator_room(game_id):
+    """Room of the spectators of ``game_id``, apart from the players' room"""
+    return "watch:" + game_id
+
+
+class SpectatorHub:
+    """Read-only watchers of games
+
+    The spectators of a game share one room, separate from the players', so
+    each update is a single room emit encoded once for all of them, and can
+    be held back ``delay`` seconds with one timer per update rather than per
+    spectator. A spectator with more than ``max_backlog`` packets waiting on
+    its connection is taken out of the room instead of being queued more
+    moves; once its backlog drains it gets the latest ``board_state`` and
+    rejoins. Backlogs are only seen for connections to this process.
+
+    With ``shared`` set, spectators may be connected to other processes
+    behind a message queue, so updates go to the room even when nobody here
+    watches the game; only the backlog bookkeeping stays per process.
+    """
+
+    def __init__(
+        self,
+        socketio,
+        timers,
+        delay=0.0,
+        max_backlog=DEFAULT_MAX_BACKLOG,
+        shared=False,
+    ):
+        self.socketio = socketio
+        self.timers = timers
+        self.delay = delay
+        self.max_backlog = max_backlog
+        self.shared = shared
+        self._lock = threading.Lock()
+        # {game_id: {sid, ...}} and {sid: game_id}
+        self._watchers = {}
+        self._watching = {}
+        # Spectators out of their room until their backlog drains
+        self._lagging = set()
+        self.stats = {"updates": 0, "dropped": 0, "resyncs": 0}
+
+    def __len__(self):
+        return len(self._watching)
+
+    def watchers(self, game_id):
+        """Number of spectators of ``game_id`` connected to this process"""
+        return len(self._watchers.get(game_id, ()))
+
+    def watched(self, game_id):
+        """Whether updates to ``game_id`` may have spectators to reach"""
+        return self.shared or game_id in self._watchers
+
+    def add(self, sid, game_id, state):
+        """Have ``sid`` watch ``game_id``, starting from the board_state ``state``"""
+        self.remove(sid)
+        with self._lock:
+            self._watching[sid] = game_id
+            self._watchers.setdefault(game_id, set()).add(sid)
+        self._later(self._start, game_id, [sid], state)
+
+    def remove(self, sid):
+        """Stop ``sid`` watching; returns the game it watched, or None"""
+        with self._lock:
+            game_id = self._watching.pop(sid, None)
+            if game_id is None:
+                return None
+            watchers = self._watchers[game_id]
+            watchers.discard(sid)
+            if not watchers:
+                del self._watchers[game_id]
+            self._lagging.discard(sid)
+        self.socketio.server.leave_room(sid, spectator_room(game_id), namespace="/")
+        return game_id
+
+    def publish(self, game_id, event, payload, state):
+        """Send ``event`` to the spectators of ``game_id``, ``delay`` seconds late
+
+        ``state`` returns the game's board_state now; it is only called when
+        lagging spectators have caught up and need resyncing.
+        """
+        with self._lock:
+            watchers = self._watchers.get(game_id, ())
+            if not watchers and not self.shared:
+                return
+            room = spectator_room(game_id)
+            dropped, caught_up = [], []
+            for sid in watchers:
+                backlogged = self._backlog(sid) > self.max_backlog
+                if sid in self._lagging:
+                    if not backlogged:
+                        self._lagging.discard(sid)
+                        caught_up.append(sid)
+                elif backlogged:
+                    self._lagging.add(sid)
+                    dropped.append(sid)
+            self.stats["updates"] += 1
+            self.stats["dropped"] += len(dropped)
+        for sid in dropped:
+            self.socketio.server.leave_room(sid, room, namespace="/")
+        resync = state() if caught_up else None
+        self._later(self._deliver, game_id, event, payload, caught_up, resync)
+
+    def end(self, game_id):
+        """Tell the spectators of ``game_id`` it is gone and stop their watching"""
+        with self._lock:
+            watchers = self._watchers.pop(game_id, ())
+            for sid in watchers:
+                del self._watching[sid]
+                self._lagging.discard(sid)
+        if watchers or self.shared:
+            self._later(self._close, game_id)
+
+    def _backlog(self, sid):
+        """Packets queued for ``sid`` that its connection has not taken yet"""
+        server = self.socketio.server
+        socket = server.eio.sockets.get(server.manager.eio_sid_from_sid(sid, "/"))
+        return 0 if socket is None else socket.queue.qsize()
+
+    def _later(self, callback, *args):
+        if self.delay > 0:
+            self.timers.schedule(time.monotonic() + self.delay, callback, *args)
+        else:
+            callback(*args)
+
+    def _deliver(self, game_id, event, payload, caught_up, state):
+        self.socketio.emit(event, payload, to=spectator_room(game_id))
+        if caught_up:
+            self.stats["resyncs"] += len(caught_up)
+            self._start(game_id, caught_up, state)
+
+    def _start(self, game_id, sids, state):
+        # The state already includes the update just delivered, so it goes
+        # out before the spectator rejoins the room
+        room = spectator_room(game_id)
+        for sid in sids:
+            with self._lock:
+                if self._watching.get(sid) != game_id or sid in self._lagging:
+                    continue
+            self.socketio.emit("board_state", state, to=sid)
+            self.socketio.server.enter_room(sid, room, namespace="/")
+
+    def _close(self, game_id):
+        room = spectator_room(game_id)
+        self.socketio.emit("spectating_ended", {"game_id": game_id}, to=room)
+        self.socketio.server.close_room(room, namespace="/")
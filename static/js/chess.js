@@ -1,4 +1,4 @@
-const socket = io();
+const socket = io({ transports: SOCKET_TRANSPORTS });
 
 let gameId = null;
 let playerNumber = null;
@@ -6,6 +6,8 @@ let playerColor = null;
 let board = null;
 let playerIndex = null;
 let currentPlayerTurn = 0;
+// Plies played so far, used to detect gaps in compact move_delta updates
+let currentPly = 0;
 let username = null;
 let opponentUsername = null;
 let isGameOver = false;
@@ -262,14 +264,10 @@ function selectSquare(square) {
   const el = document.querySelector('.square-' + square);
   if (el) el.classList.add('highlight-selected');
 
-  try {
-    const chess = new Chess(currentFEN);
-    const moves = chess.moves({ square: square, verbose: true });
-    moves.forEach(function(move) {
-      const squareEl = document.querySelector('.square-' + move.to);
-      if (squareEl) squareEl.classList.add('highlight-valid');
-    });
-  } catch(e) {}
+  legalTargets(square).forEach(function(to) {
+    const squareEl = document.querySelector('.square-' + to);
+    if (squareEl) squareEl.classList.add('highlight-valid');
+  });
 }
 
 function clearSelection() {
@@ -303,9 +301,7 @@ function handleSquareClick(square) {
     }
 
     // Try the move
-    const testChess = new Chess(currentFEN);
-    const testMove = testChess.move({ from: selectedSquare, to: square, promotion: 'q' });
-    if (testMove !== null) {
+    if (legalTargets(selectedSquare).includes(square)) {
       if (isPawnPromotion(selectedSquare, square)) {
         const srcPiece = chess.get(selectedSquare);
         pendingPromotionMove = { source: selectedSquare, target: square };
@@ -316,6 +312,7 @@ function handleSquareClick(square) {
         const moveObj = chessBoard.move({ from: selectedSquare, to: square });
         if (moveObj !== null) {
           currentFEN = chessBoard.fen();
+          legalMoves = null;
           socket.emit('make_move', { move: selectedSquare + square });
         }
         clearSelection();
@@ -484,14 +481,10 @@ function onMouseoverSquare(square, piece) {
   const expected = playerColor === 'white' ? 'w' : 'b';
   if (pieceColor !== expected) return;
 
-  try {
-    const chess = new Chess(currentFEN);
-    const moves = chess.moves({ square: square, verbose: true });
-    moves.forEach(move => {
-      const squareEl = document.querySelector(`.square-${move.to}`);
-      if (squareEl) squareEl.classList.add('highlight-valid');
-    });
-  } catch(e) {}
+  legalTargets(square).forEach(to => {
+    const squareEl = document.querySelector(`.square-${to}`);
+    if (squareEl) squareEl.classList.add('highlight-valid');
+  });
 }
 
 function onMouseoutSquare(square, piece) {
@@ -508,7 +501,23 @@ function onChange(oldPosition, newPosition) {
 }
 
 let currentFEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1';
+// Last position confirmed by the server (currentFEN may hold an optimistic local move)
+let confirmedFEN = currentFEN;
 let pendingPromotionMove = null;
+// Server-sent {from: [to, ...]} map of our legal moves in confirmedFEN, or
+// null when we have none and must generate moves locally
+let legalMoves = null;
+
+// Destination squares of the piece on `square`
+function legalTargets(square) {
+  if (legalMoves) return legalMoves[square] || [];
+  try {
+    const chess = new Chess(currentFEN);
+    return chess.moves({ square: square, verbose: true }).map(move => move.to);
+  } catch(e) {
+    return [];
+  }
+}
 
 function isPawnPromotion(source, target) {
   const chessBoard = new Chess(currentFEN);
@@ -569,6 +578,7 @@ function selectPromotion(piece) {
       currentFEN = chessBoard.fen();
       const uciMove = source + target + piece;
       console.log('Sending promotion move:', uciMove);
+      legalMoves = null;
       socket.emit('make_move', { move: uciMove });
     }
     pendingPromotionMove = null;
@@ -594,10 +604,8 @@ function onDrop(source, target) {
   const expected = playerColor === 'white' ? 'w' : 'b';
   if (pieceColorChar !== expected) return 'snapback';
   
-  // Check if move is legal using chess.js (best practice: validate before sending to server)
-  const testMove = chessBoard.move({ from: source, to: target, promotion: 'q' });
-  if (testMove === null) return 'snapback';
-  chessBoard.undo();
+  // Check if move is legal before sending it to the server
+  if (!legalTargets(source).includes(target)) return 'snapback';
   
   // Handle pawn promotion - show dialog and return piece to source temporarily
   if (isPawnPromotion(source, target)) {
@@ -617,6 +625,7 @@ function onDrop(source, target) {
   
   // Send to server - return 'trash' to let chessboard.js animate the piece to target
   // The server will confirm and we update from there
+  legalMoves = null;
   socket.emit('make_move', { move: uciMove });
 
   // Suppress the synthetic click event fired ~300ms after touchend on mobile
@@ -631,6 +640,7 @@ function onDrop(source, target) {
 function updateBoard(fen, animated = true) {
   // console.log('Updating board with FEN:', fen);
   currentFEN = fen;
+  confirmedFEN = fen;
   try {
     if (board) {
       // Use the position() method - this is the chessboard.js best practice
@@ -727,6 +737,9 @@ function updateGameTimer() {
 // Socket.io event handlers
 socket.on('connect', function() {
   console.log('Connected to server');
+  // Ask for compact per-move updates and legal-move hints on our turn; the
+  // server falls back to move_made otherwise
+  socket.emit('set_protocol', { version: 2, legal_moves: true });
   updateConnectionStatus('connected');
   showToast('Connected to server', 'success', 2000);
 });
@@ -827,6 +840,7 @@ socket.on('game_created', function(data) {
   username = data.username;
   isGameOver = false;
   lastMove = null;
+  currentPly = 0;
   gameStartTime = Date.now();
 
   console.log('Game created:', gameId);
@@ -851,6 +865,7 @@ socket.on('game_joined', function(data) {
   opponentUsername = data.opponent_username;
   isGameOver = false;
   lastMove = null;
+  currentPly = 0;
   gameStartTime = Date.now();
   
   console.log('Game joined:', gameId);
@@ -875,6 +890,8 @@ socket.on('opponent_joined', function(data) {
   document.getElementById('status').textContent = 'Game Started! White to move.';
   updateUI('playing');
   currentPlayerTurn = 0;
+  currentPly = (data.moves_history || []).length;
+  legalMoves = data.legal_moves || null;
 
   if (data.clock) {
     whiteClock = data.clock[0];
@@ -893,8 +910,10 @@ socket.on('opponent_joined', function(data) {
   }
 });
 
-socket.on('move_made', function(data) {
+// Apply a server-confirmed move (full move_made payload or one rebuilt from move_delta)
+function applyMove(data) {
   console.log('Move made:', data.move);
+  currentPly += 1;
   
   if (data.is_capture) playSound('capture');
   else if (data.is_check) playSound('check');
@@ -906,6 +925,7 @@ socket.on('move_made', function(data) {
   const prevFEN = currentFEN;
   updateBoard(data.board_fen);
   currentPlayerTurn = data.current_player;
+  legalMoves = data.current_player === playerIndex ? data.legal_moves || null : null;
 
   // Update clocks from authoritative server values and restart countdown
   if (data.clock) {
@@ -1003,6 +1023,78 @@ socket.on('move_made', function(data) {
   requestAnimationFrame(() => {
     moveHistoryDiv.scrollTop = moveHistoryDiv.scrollHeight;
   });
+}
+
+socket.on('move_made', applyMove);
+
+// Bits of the move_delta status field (must match STATUS_* in app.py)
+const STATUS = {
+  CHECK: 1 << 0,
+  CHECKMATE: 1 << 1,
+  STALEMATE: 1 << 2,
+  INSUFFICIENT_MATERIAL: 1 << 3,
+  REPETITION: 1 << 4,
+  FIVEFOLD_REPETITION: 1 << 5,
+  SEVENTYFIVE_MOVES: 1 << 6,
+  FIFTY_MOVES: 1 << 7,
+  CAPTURE: 1 << 8,
+  EN_PASSANT: 1 << 9,
+  CASTLE: 1 << 10
+};
+const STATUS_DRAW = STATUS.STALEMATE | STATUS.INSUFFICIENT_MATERIAL | STATUS.REPETITION |
+  STATUS.FIVEFOLD_REPETITION | STATUS.SEVENTYFIVE_MOVES | STATUS.FIFTY_MOVES;
+
+// Compact move protocol: replay the move on the last confirmed position to
+// rebuild the move_made fields; on a ply gap or mismatch resync from the server
+socket.on('move_delta', function(delta) {
+  if (delta.n !== currentPly + 1) {
+    socket.emit('get_board_state');
+    return;
+  }
+
+  const from = delta.m.slice(0, 2);
+  const to = delta.m.slice(2, 4);
+  const promotion = delta.m.length === 5 ? delta.m[4] : null;
+  const chessBoard = new Chess(confirmedFEN);
+  const moveObj = chessBoard.move({ from: from, to: to, promotion: promotion || undefined });
+  if (!moveObj) {
+    socket.emit('get_board_state');
+    return;
+  }
+
+  let capturedSymbol = null;
+  if (moveObj.captured) {
+    const capturer = moveObj.color === 'w' ? 'white' : 'black';
+    const victim = moveObj.color === 'w' ? 'black' : 'white';
+    capturedSymbol = victim === 'white' ? moveObj.captured.toUpperCase() : moveObj.captured;
+    capturedPieces[capturer].push({ type: capturedSymbol, color: victim });
+  }
+
+  const s = delta.s;
+  applyMove({
+    move: delta.m,
+    from: from,
+    to: to,
+    promotion: promotion,
+    board_fen: chessBoard.fen(),
+    is_check: !!(s & STATUS.CHECK),
+    is_checkmate: !!(s & STATUS.CHECKMATE),
+    is_stalemate: !!(s & STATUS.STALEMATE),
+    is_insufficient_material: !!(s & STATUS.INSUFFICIENT_MATERIAL),
+    is_repetition: !!(s & STATUS.REPETITION),
+    is_fivefold_repetition: !!(s & STATUS.FIVEFOLD_REPETITION),
+    is_seventyfive_moves: !!(s & STATUS.SEVENTYFIVE_MOVES),
+    is_fifty_moves: !!(s & STATUS.FIFTY_MOVES),
+    is_draw: !!(s & STATUS_DRAW),
+    is_capture: !!(s & STATUS.CAPTURE),
+    is_en_passant: !!(s & STATUS.EN_PASSANT),
+    is_castle: !!(s & STATUS.CASTLE),
+    captured_piece: capturedSymbol,
+    captured_pieces: capturedPieces,
+    current_player: delta.n % 2,
+    clock: delta.c,
+    legal_moves: delta.l
+  });
 });
 
 socket.on('board_state', function(data) {
@@ -1011,6 +1103,8 @@ socket.on('board_state', function(data) {
   else updateBoard(data.board_fen, false);
   
   currentPlayerTurn = data.current_player;
+  currentPly = (data.moves_history || []).length;
+  legalMoves = data.legal_moves || null;
   if (data.usernames) {
     opponentUsername = data.usernames[1 - data.player_index];
     document.getElementById('opponentName').textContent = opponentUsername || 'Waiting...';
@@ -1039,7 +1133,9 @@ socket.on('game_reset', function(data) {
   cancelPendingPromotion();
   currentFEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1';
   currentPlayerTurn = 0;
+  currentPly = 0;
   pendingPromotionMove = null;
+  legalMoves = null;
   isGameOver = false;
   lastMove = null;
   gameStartTime = Date.now();
@@ -1146,6 +1242,13 @@ socket.on('opponent_disconnected', function(data) {
   }, 1000);
 });
 
+socket.on('opponent_reconnect_expired', function(data) {
+  clearInterval(disconnectCountdownInterval);
+  const el = document.getElementById('disconnectCountdown');
+  if (el) el.textContent = 0;
+  showToast((data.username || 'Opponent') + ' did not reconnect — you can claim the win', 'warning');
+});
+
 socket.on('opponent_reconnected', function(data) {
   clearInterval(disconnectCountdownInterval);
   const dialog = document.getElementById('disconnectDialog');
@@ -1162,6 +1265,8 @@ socket.on('reconnected', function(data) {
   username = data.username;
   opponentUsername = data.opponent_username;
   currentPlayerTurn = data.current_player;
+  currentPly = (data.moves_history || []).length;
+  legalMoves = data.legal_moves || null;
   capturedPieces = data.captured_pieces || { white: [], black: [] };
   isGameOver = false;
   lastMove = null;
@@ -1256,6 +1361,9 @@ socket.on('game_ended', function(data) {
   if (data.result === 'draw') {
     showToast('Game ended in a draw!', 'info');
     document.getElementById('status').innerHTML = `<span class="status-draw">${data.message}</span>`;
+  } else if (data.result === 'tablebase') {
+    showToast(data.winner === username ? 'You won!' : 'You lost.', data.winner === username ? 'success' : 'error');
+    document.getElementById('status').innerHTML = `<span class="${data.winner === username ? 'status-win' : 'status-lose'}">${data.message}</span>`;
   } else if (data.result === 'resignation') {
     if (data.winner === username) {
       showToast('You won! Opponent resigned.', 'success');
@@ -1379,6 +1487,16 @@ function createGame() {
   socket.emit('create_game', { username: username });
 }
 
+function createBotGame() {
+  let name = document.getElementById('botUsername').value.trim() || 'Player 1';
+  if (name.length > 20) name = name.substring(0, 20);
+  const level = parseInt(document.getElementById('botLevel').value, 10);
+
+  username = name;
+  console.log('Starting bot game at level', level, 'as', username);
+  socket.emit('create_bot_game', { username: username, level: level, color: 'random' });
+}
+
 function joinGame() {
   const usernameInput = document.getElementById('joinUsername');
   const gameIdInput = document.getElementById('joinGameId');
@@ -1502,11 +1620,13 @@ function resetGame() {
   playerColor = null;
   playerIndex = null;
   currentPlayerTurn = 0;
+  currentPly = 0;
   opponentUsername = null;
   isGameOver = false;
   lastMove = null;
   gameStartTime = null;
   currentFEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1';
+  confirmedFEN = currentFEN;
   
   // Best practice: reset board to start position
   if (board) {
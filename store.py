@@ -0,0 +1,244 @@
+import json
+import struct
+import sys
+import time
+from array import array
+
+from models import DisconnectedPlayer, Game, decode_move
+
+# Shared game record: <u32 version> <u16 metadata length> <metadata JSON>
+# <moves as little-endian u16 codes>
+RECORD_HEADER = struct.Struct("<IH")
+
+
+class GameConflict(Exception):
+    """Another process changed or removed the game since it was loaded"""
+
+
+class MemoryGameStore:
+    """Games held in this process; ``save`` is a no-op because callers share the objects"""
+
+    def __init__(self):
+        self._games = {}
+
+    def __contains__(self, game_id):
+        return game_id in self._games
+
+    def __len__(self):
+        return len(self._games)
+
+    def get(self, game_id):
+        return self._games.get(game_id)
+
+    def add(self, game):
+        """Store a new game; GameConflict if the id is taken"""
+        if game.game_id in self._games:
+            raise GameConflict(game.game_id)
+        self._games[game.game_id] = game
+
+    def save(self, game):
+        pass
+
+    def discard(self, game_id):
+        """Remove a game and return it, or None if it was already gone"""
+        return self._games.pop(game_id, None)
+
+
+class RedisGameStore:
+    """Games shared through Redis (or anything speaking its protocol)
+
+    Each game is one key holding its FEN, clocks, players and packed move
+    list. Writes are optimistic: ``save`` fails with GameConflict if the
+    stored version moved on since the game was loaded. Loaded games are
+    kept per process so a newer version only replays the moves it lacks.
+    Keys expire after ``ttl`` seconds without a write as a backstop for
+    games no process is still timing.
+    """
+
+    def __init__(self, client, prefix="chess:game:", ttl=86400):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._cache = {}
+
+    def _key(self, game_id):
+        return self.prefix + game_id
+
+    def __contains__(self, game_id):
+        return bool(self.client.exists(self._key(game_id)))
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+    def get(self, game_id):
+        record = self.client.get(self._key(game_id))
+        if record is None:
+            self._cache.pop(game_id, None)
+            return None
+        game = self._load(game_id, record)
+        self._cache[game_id] = game
+        return game
+
+    def add(self, game):
+        """Store a new game; GameConflict if the id is taken"""
+        if not self.client.set(
+            self._key(game.game_id), _dump(game, game.version), nx=True, ex=self.ttl
+        ):
+            raise GameConflict(game.game_id)
+        self._cache[game.game_id] = game
+
+    def save(self, game):
+        """Write ``game`` back unless another process saved it first"""
+        from redis.exceptions import WatchError
+
+        key = self._key(game.game_id)
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.watch(key)
+                record = pipe.get(key)
+                if (
+                    record is None
+                    or RECORD_HEADER.unpack_from(record)[0] != game.version
+                ):
+                    raise GameConflict(game.game_id)
+                pipe.multi()
+                pipe.set(key, _dump(game, game.version + 1), ex=self.ttl)
+                pipe.execute()
+        except (GameConflict, WatchError):
+            self._cache.pop(game.game_id, None)
+            raise GameConflict(game.game_id)
+        game.version += 1
+
+    def discard(self, game_id):
+        """Remove a game and return this process's copy of it, if any"""
+        self.client.delete(self._key(game_id))
+        return self._cache.pop(game_id, None)
+
+    def _load(self, game_id, record):
+        version, meta_length = RECORD_HEADER.unpack_from(record)
+        game = self._cache.get(game_id)
+        if game is not None and game.version == version:
+            return game
+
+        start = RECORD_HEADER.size
+        meta = json.loads(record[start : start + meta_length])
+        moves = array("H", record[start + meta_length :])
+        if sys.byteorder == "big":
+            moves.byteswap()
+
+        # Same moves from the same start give the same position and
+        # repetition history, so a cached copy only needs the missing tail
+        if game is None or moves[: len(game.moves)] != game.moves:
+            game = Game(game_id, meta["time_control"], None, None)
+        for code in moves[len(game.moves) :]:
+            game.push(decode_move(code))
+
+        previous = game.disconnected_players
+        _restore_meta(game, meta)
+        for i, dc in enumerate(game.disconnected_players):
+            if (
+                dc is not None
+                and previous[i] is not None
+                and previous[i].username == dc.username
+            ):
+                dc.timer = previous[i].timer
+
+        game.state_snapshot = None
+        game.version = version
+        return game
+
+
+def _restore_meta(game, meta):
+    """Set ``game``'s players, clock and status from ``_game_meta`` output"""
+    now = time.time()
+    to_monotonic = time.monotonic() - now
+    game.players = meta["players"]
+    game.usernames = meta["usernames"]
+    game.current_player = meta["current_player"]
+    game.start_time = meta["start_time"]
+    game.last_activity = meta["last_activity"] + to_monotonic
+    game.captured = bytearray(meta["captured"])
+    game.result = meta["result"]
+    game.winner = meta.get("winner")
+    game.archived = meta.get("archived", False)
+    opening = meta.get("opening")
+    game.opening = tuple(opening) if opening else None
+    game.bot = meta.get("bot")
+
+    clock = game.clock
+    clock.remaining, clock.running, started_at, clock.flagged = meta["clock"]
+    clock.started_at = None if started_at is None else started_at + to_monotonic
+
+    game.disconnected_players = [None, None]
+    for i, entry in enumerate(meta["disconnected"]):
+        if entry is None:
+            continue
+        username, disconnected_at, deadline, expired = entry
+        dc = DisconnectedPlayer(username, deadline + to_monotonic)
+        dc.disconnected_at = disconnected_at
+        dc.expired = expired
+        game.disconnected_players[i] = dc
+
+
+def _game_meta(game):
+    """Everything about ``game`` but its moves, with wall-clock times"""
+    to_wall = time.time() - time.monotonic()
+    clock = game.clock
+    return {
+        "fen": game.board.fen(),
+        "time_control": game.time_control,
+        "players": game.players,
+        "usernames": game.usernames,
+        "current_player": game.current_player,
+        "start_time": game.start_time,
+        "last_activity": game.last_activity + to_wall,
+        "captured": list(game.captured),
+        "result": game.result,
+        "winner": game.winner,
+        "archived": game.archived,
+        "opening": game.opening,
+        "bot": game.bot,
+        "clock": [
+            clock.remaining,
+            clock.running,
+            None if clock.started_at is None else clock.started_at + to_wall,
+            clock.flagged,
+        ],
+        "disconnected": [
+            None
+            if dc is None
+            else [dc.username, dc.disconnected_at, dc.deadline + to_wall, dc.expired]
+            for dc in game.disconnected_players
+        ],
+    }
+
+
+def _dump(game, version):
+    """Serialize ``game`` as a shared record with the given version"""
+    encoded = json.dumps(_game_meta(game), separators=(",", ":")).encode("utf-8")
+    moves = game.moves
+    if sys.byteorder == "big":
+        moves = array("H", moves)
+        moves.byteswap()
+    return RECORD_HEADER.pack(version, len(encoded)) + encoded + moves.tobytes()
+
+
+def open_game_store(backend, url=None, ttl=86400, journal=None):
+    """Create the game store for ``backend`` ("memory" or "redis")
+
+    A memory store with a GameJournal logs every change to it and starts
+    with the games the journal recovers.
+    """
+    if backend == "memory":
+        if journal is not None:
+            from journal import JournaledGameStore
+
+            return JournaledGameStore(journal)
+        return MemoryGameStore()
+    if journal is not None:
+        raise ValueError("Only the memory game store uses a journal")
+    if backend == "redis":
+        import redis
+
+        return RedisGameStore(redis.Redis.from_url(url), ttl=ttl)
+    raise ValueError(f"Unknown game store backend: {backend}")
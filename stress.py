@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Copies of each conflicting event fired at once
+DEFAULT_COPIES = 8
+DEFAULT_THREADS = 32
+
+
+class Player:
+    """A test client in one of the stress games"""
+
+    def __init__(self, app, name):
+        self.name = name
+        self.client = app.socketio.test_client(app.app)
+        self.sid = app.socketio.server.manager.sid_from_eio_sid(
+            self.client.eio_sid, "/"
+        )
+
+    def emit(self, event, *args):
+        self.client.emit(event, *args)
+
+
+def _fire(events, threads, seed):
+    """Emit every ``(player, event, args)`` in random order from ``threads``
+    threads at once; returns the handler exceptions"""
+    events = list(events)
+    random.Random(seed).shuffle(events)
+    errors = []
+
+    def run(item):
+        player, event, args = item
+        try:
+            player.emit(event, *args)
+        except Exception as e:
+            errors.append(f"{event} from {player.name}: {e!r}")
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(run, events))
+    return errors
+
+
+def _stress(games, copies, threads, seed=1):
+    """Play ``games`` games through the socket handlers, firing ``copies``
+    of each conflicting event at once, and check that none is applied twice
+
+    Returns ``(events, seconds, violations)``.
+    """
+    # Settings are read when app.py is imported; keep its files out of the
+    # working directory
+    os.chdir(tempfile.mkdtemp(prefix="chess-stress-"))
+    os.environ.setdefault("ENGINE_WORKERS", "0")
+    os.environ.setdefault("GAME_SEARCH_DB", "")
+    import app
+
+    pairs = []
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for i in range(games):
+            white, black = Player(app, f"w{i}"), Player(app, f"b{i}")
+            white.emit("create_game", {"username": white.name, "time_control": "5+0"})
+            game_id = app.session_game_id(white.sid)
+            black.emit("join_game", {"game_id": game_id, "username": black.name})
+            pairs.append((game_id, white, black))
+
+        started = time.perf_counter()
+        fired = 0
+        errors = []
+        # Duplicated submits: each side sends its move ``copies`` times
+        for player_index, uci in ((1, "e2e4"), (2, "e7e5")):
+            events = [
+                (pair[player_index], "make_move", ({"move": uci},))
+                for pair in pairs
+                for _ in range(copies)
+            ]
+            errors += _fire(events, threads, seed + player_index)
+            fired += len(events)
+        moves = {
+            game_id: len(app.game_store.get(game_id).moves) for game_id, *_ in pairs
+        }
+
+        # Conflicting endings: both resign, both accept a draw, a move and
+        # a timeout claim, all at once
+        events = []
+        for _, white, black in pairs:
+            for _ in range(copies):
+                events += [
+                    (white, "resign", ()),
+                    (black, "resign", ()),
+                    (white, "request_draw", ({},)),
+                    (black, "accept_draw", ()),
+                    (white, "make_move", ({"move": "g1f3"},)),
+                    (black, "timeout", ()),
+                ]
+        errors += _fire(events, threads, seed + 3)
+        fired += len(events)
+        results = {game_id: app.game_store.get(game_id).result for game_id, *_ in pairs}
+
+        # Expiry racing the players' last events
+        for game_id, *_ in pairs:
+            app.game_store.get(game_id).last_activity -= app.GAME_EXPIRY_SECONDS
+        events = []
+        for game_id, white, black in pairs:
+            events += [
+                (white, "reset_game", ()),
+                (black, "make_move", ({"move": "d7d5"},)),
+                (white, "leave_game", ()),
+            ]
+            events += [(ExpiryTimer(app, game_id), "expire", ())] * copies
+        errors += _fire(events, threads, seed + 4)
+        fired += len(events)
+        elapsed = time.perf_counter() - started
+
+    violations = list(errors)
+    now = time.monotonic()
+    for game_id, white, black in pairs:
+        if moves[game_id] != 2:
+            violations.append(f"{game_id}: {moves[game_id]} plies accepted, not 2")
+        if results[game_id] is None:
+            violations.append(f"{game_id}: never ended")
+        # A game reset in time stays; an idle one must be gone
+        game = app.game_store.get(game_id)
+        if game is not None and game.last_activity + app.GAME_EXPIRY_SECONDS < now:
+            violations.append(f"{game_id}: survived expiry")
+        for player in (white, black):
+            stats = app.leaderboard_store.get_player(player.name) or {}
+            recorded = stats.get("total_games", 0)
+            if recorded != 1:
+                violations.append(f"{player.name}: {recorded} results recorded")
+            rated = len(app.rating_engine.history(player.name))
+            if rated != 1:
+                violations.append(f"{player.name}: rated {rated} times")
+    if app.game_archive is not None:
+        archived = [archived.game_id for archived in app.game_archive.scan()]
+        if sorted(archived) != sorted(game_id for game_id, *_ in pairs):
+            violations.append(f"{len(archived)} games archived for {games} played")
+    return fired, elapsed, violations
+
+
+class ExpiryTimer:
+    """Stands in for a player to run the inactivity timer's callback"""
+
+    def __init__(self, app, game_id):
+        self.app = app
+        self.name = "expiry timer"
+        self.game_id = game_id
+
+    def emit(self, event):
+        self.app.handle_game_expiry(self.game_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fire conflicting game events from many threads at once"
+    )
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--copies", type=int, default=DEFAULT_COPIES)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    args = parser.parse_args()
+    fired, elapsed, violations = _stress(args.games, args.copies, args.threads)
+    print(f"Fired {fired} events over {args.games} games in {elapsed:.2f}s")
+    for violation in violations[:20]:
+        print(violation)
+    if violations:
+        print(f"{len(violations)} invariant violations")
+        sys.exit(1)
+    print("Every move accepted once and every game ended and recorded once")
@@ -0,0 +1,238 @@
+import os
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.syzygy
+
+# Probe results kept per process, least recently used dropped first
+DEFAULT_PROBE_CACHE_ENTRIES = 100000
+
+
+class EndgameTablebase:
+    """Syzygy tables with a bounded cache of probe results in front
+
+    ``path`` lists table directories separated by ``os.pathsep``. Only the
+    file names are read up front; python-chess opens and memory-maps each
+    table the first time a position needs it, keeping at most ``max_fds``
+    open, so processes probing the same tables share their pages.
+    """
+
+    def __init__(self, path, cache_entries=DEFAULT_PROBE_CACHE_ENTRIES, max_fds=128):
+        self._tables = chess.syzygy.Tablebase(max_fds=max_fds)
+        for directory in path.split(os.pathsep):
+            if directory:
+                self._tables.add_directory(directory)
+        # "KRvK" is a 3-piece table
+        names = list(self._tables.wdl) + list(self._tables.dtz)
+        self.max_pieces = max((len(name) - 1 for name in names), default=0)
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def covers(self, board):
+        """Whether ``board`` has few enough pieces to be in the tables"""
+        return (
+            chess.popcount(board.occupied) <= self.max_pieces
+            and not board.castling_rights
+        )
+
+    def _probe(self, kind, board):
+        key = (kind, board.epd())
+        with self._lock:
+            value = self._cache.get(key, self)
+            if value is not self:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            self.stats["misses"] += 1
+        try:
+            if kind == "wdl":
+                value = self._tables.probe_wdl(board)
+            else:
+                value = self._tables.probe_dtz(board)
+        except KeyError:
+            # The table for this material is missing
+            value = None
+        except (OSError, ValueError) as e:
+            print(f"Unreadable tablebase file: {e}")
+            value = None
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return value
+
+    def wdl(self, board):
+        """Win/draw/loss (2 to -2) for the side to move, or None if not in the tables
+
+        1 and -1 are wins and losses spoiled by the 50-move rule.
+        """
+        if not self.covers(board):
+            return None
+        return self._probe("wdl", board)
+
+    def dtz(self, board):
+        """Distance to the next capture or pawn move with best play, or None"""
+        if not self.covers(board):
+            return None
+        return self._probe("dtz", board)
+
+    def best_move(self, board):
+        """The move keeping the best tablebase result, or None if not covered
+
+        Wins take mate, then a capture or pawn move, then the shortest
+        distance to one; losses take the longest. Moves into positions whose
+        tables are missing, such as underpromotions without KBvK, are
+        skipped, unless every move keeping the result is one of them.
+        """
+        expected = self.wdl(board)
+        if expected is None:
+            return None
+        best_move, best_key = None, None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                wdl, dtz = self.wdl(board), self.dtz(board)
+                mate = board.is_checkmate()
+            finally:
+                board.pop()
+            if wdl is None or dtz is None:
+                continue
+            # The child is scored for the opponent
+            result = -wdl
+            if result > 0:
+                key = (result, mate, zeroing, -abs(dtz))
+            elif result < 0:
+                key = (result, False, False, abs(dtz))
+            else:
+                key = (0, False, False, 0)
+            if best_key is None or key > best_key:
+                best_move, best_key = move, key
+        if best_key is None or best_key[0] < expected:
+            return None
+        return best_move
+
+    def adjudicate(self, board, mode="draws"):
+        """``(result, winner)`` to end a game at ``board`` with, or None
+
+        ``mode`` is "off", "draws" (tablebase draws end the game) or "all"
+        (tablebase wins too); ``winner`` is the winning colour, or None for
+        a draw.
+        """
+        if mode == "off":
+            return None
+        wdl = self.wdl(board)
+        if wdl is None:
+            return None
+        # 1 and -1 are wins the 50-move rule turns into draws
+        if abs(wdl) < 2:
+            return "tablebase_draw", None
+        if mode == "all":
+            return "tablebase_win", board.turn if wdl > 0 else not board.turn
+        return None
+
+    def close(self):
+        self._tables.close()
+
+
+def _play_out(tablebase, board, limit=200):
+    """Play ``board`` out with ``best_move`` for both sides, checking that
+    every move keeps the result; returns the final board"""
+    while not board.is_game_over() and limit:
+        expected = tablebase.wdl(board)
+        move = tablebase.best_move(board)
+        board.push(move)
+        assert -tablebase.wdl(board) == expected, f"{move} spoils {expected}"
+        limit -= 1
+    return board
+
+
+def _check(path):
+    """Probe the bundled tables and assert what they must say"""
+    tablebase = EndgameTablebase(path)
+    assert tablebase.max_pieces == 4
+
+    # Not covered: too many pieces, castling rights, or a missing table
+    # (KRvKR)
+    rooks = chess.Board("8/8/8/3k4/3r4/8/8/R3K3 w - - 0 1")
+    assert tablebase.wdl(chess.Board()) is None
+    assert tablebase.wdl(chess.Board("4k3/8/8/8/8/8/8/R3K3 w Q - 0 1")) is None
+    assert tablebase.wdl(rooks) is None
+    assert tablebase.best_move(rooks) is None
+
+    # A lone minor piece cannot win
+    for fen in ("8/8/8/8/8/2k5/4B3/4K3 w - - 0 1", "8/8/8/8/8/2k5/4N3/4K3 b - - 0 1"):
+        assert tablebase.wdl(chess.Board(fen)) == 0
+
+    # Win, loss and draw for the side to move
+    rook = chess.Board("8/8/8/3k4/8/8/8/R3K3 w - - 0 1")
+    assert tablebase.wdl(rook) == 2 and tablebase.dtz(rook) > 0
+    rook.turn = chess.BLACK
+    assert tablebase.wdl(rook) == -2 and tablebase.dtz(rook) < 0
+    rook_pawn = chess.Board("k7/8/K7/P7/8/8/8/8 w - - 0 1")
+    assert tablebase.wdl(rook_pawn) == 0
+
+    # Mate when there is one, and never stalemate
+    queen = chess.Board("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1")
+    move = tablebase.best_move(queen)
+    queen.push(move)
+    assert queen.is_checkmate(), f"{move} does not mate"
+    # Take the pawn move that keeps the win over equally winning king moves
+    pawn = chess.Board("8/8/8/8/8/8/4P3/2K4k w - - 0 1")
+    assert pawn.is_zeroing(tablebase.best_move(pawn))
+    # Promote to a piece that wins, not to a drawn bishop or knight
+    promotion = chess.Board("8/4P3/8/8/8/8/k7/4K3 w - - 0 1")
+    for piece, expected in ((chess.BISHOP, 0), (chess.KNIGHT, 0), (chess.QUEEN, -2)):
+        promotion.push(chess.Move(chess.E7, chess.E8, piece))
+        assert tablebase.wdl(promotion) == expected
+        promotion.pop()
+    assert tablebase.best_move(promotion).promotion in (chess.QUEEN, chess.ROOK)
+    # Underpromotions to KRvKR, KRvKB and KRvKN have no table and are
+    # skipped rather than making the whole position unknown
+    skipped = chess.Board("8/8/8/8/8/8/R2p4/K1k5 b - - 0 1")
+    for piece in (chess.ROOK, chess.BISHOP, chess.KNIGHT):
+        skipped.push(chess.Move(chess.D2, chess.D1, piece))
+        assert tablebase.wdl(skipped) is None
+        skipped.pop()
+    assert tablebase.wdl(skipped) == 2
+    assert tablebase.best_move(skipped) == chess.Move.from_uci("d2d1q")
+    # Played out, wins end in mate within the 50-move rule and draws hold
+    for fen in (
+        "8/8/8/3k4/8/8/8/R3K3 w - - 0 1",
+        "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1",
+        "8/8/8/8/8/k7/8/K1Q5 b - - 0 1",
+        "8/8/8/3k4/8/8/3r4/Q3K3 w - - 0 1",
+    ):
+        board = _play_out(tablebase, chess.Board(fen))
+        assert board.is_checkmate(), f"{fen} ended {board.result()}"
+    board = _play_out(tablebase, chess.Board("4k3/8/8/8/8/8/4P3/4K3 b - - 0 1"))
+    assert board.result(claim_draw=True) == "1/2-1/2"
+
+    # Adjudication by mode
+    rook.turn = chess.WHITE
+    assert tablebase.adjudicate(rook, "draws") is None
+    assert tablebase.adjudicate(rook, "all") == ("tablebase_win", chess.WHITE)
+    rook.turn = chess.BLACK
+    assert tablebase.adjudicate(rook, "all") == ("tablebase_win", chess.WHITE)
+    assert tablebase.adjudicate(rook_pawn, "draws") == ("tablebase_draw", None)
+    assert tablebase.adjudicate(rook_pawn, "off") is None
+    assert tablebase.adjudicate(chess.Board(), "all") is None
+    tablebase.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check probing of Syzygy tables")
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "syzygy"),
+        help="directory holding the tables bundled in syzygy/",
+    )
+    args = parser.parse_args()
+    _check(args.path)
+    print(f"Tablebase checks passed against {args.path}")
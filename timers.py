@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class Timer:
+    """Handle for a scheduled callback; ``cancel()`` is O(1)"""
+
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerService:
+    """Runs callbacks at ``time.monotonic()`` deadlines from one thread
+
+    Timers live in a heap and the thread sleeps until the earliest deadline,
+    so nothing is polled. Cancelled timers are dropped lazily when they reach
+    the top of the heap, or all at once when they make up most of it.
+    """
+
+    def __init__(self, name="timers", start_task=None):
+        self.name = name
+        # e.g. socketio.start_background_task, so the runner is a greenlet
+        # under eventlet/gevent instead of an OS thread
+        self._start_task = start_task
+        self._heap = []
+        self._cancelled = 0
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, deadline, callback, *args):
+        """Call ``callback(*args)`` once ``time.monotonic()`` reaches ``deadline``"""
+        timer = Timer(deadline, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), timer))
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+            if self._thread is None:
+                if self._start_task is not None:
+                    self._thread = self._start_task(self._run)
+                else:
+                    self._thread = threading.Thread(
+                        target=self._run, name=self.name, daemon=True
+                    )
+                    self._thread.start()
+        return timer
+
+    def cancel(self, timer):
+        """Cancel ``timer`` if it has not fired yet"""
+        if timer is None or timer.cancelled:
+            return
+        with self._cond:
+            timer.cancel()
+            self._cancelled += 1
+            if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, timer = self._heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled = max(0, self._cancelled - 1)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                timer.cancelled = True
+                return timer
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"Timer callback {timer.callback.__name__} failed: {e}")
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import struct
+import threading
+
+# Frames on a worker socket: <u32 length> <pickled message>
+FRAME_HEADER = struct.Struct("<I")
+
+
+class WorkerPool:
+    """``count`` forked processes answering pickled requests over socketpairs
+
+    ``handler_factory`` is called once in each child and returns the
+    function that turns a request into a reply. Requests to one worker are
+    serialized by a lock; a worker that dies is restarted and the request
+    retried once, so handlers must be able to rebuild any state they keep
+    from the requests themselves.
+    """
+
+    def __init__(self, count, handler_factory, name="worker"):
+        if count < 1:
+            raise ValueError(f"A {name} pool needs at least one process")
+        self.name = name
+        self._handler_factory = handler_factory
+        self._context = multiprocessing.get_context("fork")
+        self._workers = [None] * count
+        self._locks = [threading.Lock() for _ in range(count)]
+        for index in range(count):
+            self._start(index)
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _start(self, index):
+        """Fork worker ``index`` and connect it to this process"""
+        ours, theirs = socket.socketpair()
+        # The child must not hold the other workers' sockets open, or they
+        # would never see end-of-file when this process dies
+        inherited = [w[0].fileno() for w in self._workers if w is not None]
+        process = self._context.Process(
+            target=_run_worker,
+            args=(theirs.fileno(), [ours.fileno()] + inherited, self._handler_factory),
+            name=f"{self.name}-{index}",
+            daemon=True,
+        )
+        process.start()
+        theirs.close()
+        self._workers[index] = (ours, process)
+
+    def call(self, index, message):
+        """Send ``message`` to worker ``index`` and return its reply"""
+        with self._locks[index]:
+            for attempt in (1, 2):
+                sock, process = self._workers[index]
+                try:
+                    _send(sock.sendall, message)
+                    reply = _recv(sock.recv)
+                    break
+                except (OSError, EOFError):
+                    print(f"{self.name} {index} failed, restarting")
+                    sock.close()
+                    process.join(timeout=1)
+                    self._workers[index] = None
+                    self._start(index)
+                    if attempt == 2:
+                        raise
+        if reply[0] == "error":
+            raise RuntimeError(f"{self.name} {index}: {reply[1]}")
+        return reply
+
+    def close(self):
+        for sock, process in self._workers:
+            sock.close()
+        for sock, process in self._workers:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def _send(sendall, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(recv, size):
+    chunks = []
+    while size:
+        chunk = recv(size)
+        if not chunk:
+            raise EOFError("worker connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(recv):
+    (length,) = FRAME_HEADER.unpack(_recv_exact(recv, FRAME_HEADER.size))
+    return pickle.loads(_recv_exact(recv, length))
+
+
+def _run_worker(fd, close_fds, handler_factory):
+    """Worker process: answer requests on ``fd`` until the server goes away"""
+    # Ctrl-C reaches the whole process group; the server shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for other in close_fds:
+        os.close(other)
+    # gevent and eventlet hand out non-blocking sockets; this loop waits on reads
+    os.set_blocking(fd, True)
+
+    def recv(size):
+        return os.read(fd, size)
+
+    def sendall(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+
+    handle = handler_factory()
+    while True:
+        try:
+            message = _recv(recv)
+        except (OSError, EOFError):
+            return
+        try:
+            reply = handle(message)
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        _send(sendall, reply)